@@ -1,19 +1,45 @@
 # The version supporting the heroku app.
+import os
+import threading
+from urllib.parse import urlencode
+
 # Dash components
 import dash
 import dash_core_components as dcc 
 import dash_html_components as html
 import dash_table
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 
-# Pandas for creating dataframe for maps
+# Pandas and numpy for the columnar crime data behind the maps
+import numpy as np
 import pandas as pd
 
+# Flask for the download route
+from flask import Response, abort, request, stream_with_context
+
+# Concurrent fetching of several months
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 # Caching
 from flask_caching import Cache
+from crime_cache import CrimeCache
+
+# Prometheus metrics served on /metrics
+import metrics
+from query_cache import cached_query
 
 # Police api
-from police_api import PoliceAPI
+from police_api import APIError
+from police_transport import make_police_api
+from local_store import LocalCrimeStore
+from reference_data import Catalogue, ReferenceData
+from geometry import simplify_polygon, split_polygon
+from table_query import table_page
+from rollups import CrimeRollups
+from jobs import JobRunner
+from export import EXPORT_FORMATS, csv_chunks, gzip_chunks, parquet_available, parquet_chunks
 
 # external stylesheet stored in assets folder
 external_stylesheets = ['https://fonts.googleapis.com/css?family=Nunito'] 
@@ -22,7 +48,9 @@ external_stylesheets = ['https://fonts.googleapis.com/css?family=Nunito']
 # Dash app
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 server = app.server # Needed for heroku deployment
+app.config.suppress_callback_exceptions = True # crime_table is created by a callback
 cache = Cache(server, config={"CACHE_TYPE":"simple"})
+crime_cache = CrimeCache(on_lookup=lambda key, hit:metrics.record_cache(key.split(':')[0], hit)) # shared by all gunicorn workers
 app.title = 'Street Level Crime'
 
 # Constants which will not change including the Mapbox token for accessing the Mapbox API
@@ -44,11 +72,44 @@ CRIME_CATEGORY_COLOUR ={
                         'Vehicle crime':'brown',
                         'Other crime':'light blue',
                         'Robbery':'Yellow'}
+LATEST_MONTH_TTL = 24 * 60 * 60 # the latest month may still be revised
+PUBLISHED_MONTH_TTL = 30 * 24 * 60 * 60 # earlier months never change
+MAX_FETCH_WORKERS = 6 # upper bound on concurrent upstream crime queries
+CRIME_TABLE_PAGE_SIZE = 15
+TREND_MONTHS = 12 # months shown on the trend chart
+JOB_POLL_INTERVAL = 500 # milliseconds between progress checks of a crime query
+HIDDEN = {'display':'none'} # style of the cancel button when no query is running
+SHOWN = {'fontFamily':'nunito'}
+MAP_ZOOM = 12 # zoom of the map after submit
+CLUSTER_MAX_ZOOM = 15 # from this zoom in every anonymised location is drawn on its own
+CLUSTER_CELL_PIXELS = 24 # size of a crime cluster on screen
+MAX_SPLIT_DEPTH = 4 # areas over the api's 10,000 crime cap are split at most this many times
+MAX_SPLIT_WORKERS = 8 # concurrent requests for the pieces of split areas
+REFERENCE_WAIT = 10 # seconds a page load waits for the first reference data after a cold start
+NATIONAL_WORKERS = 8 # neighbourhoods aggregated at once for the overview, the api rate limit still applies
+ROLLUP_JOB_WORKERS = 2 # national and new month rollups running at once in a worker
+OVERVIEW_TOLERANCE = 0.002 # boundary simplification on the overview map, in degrees
+# Crime data backend, 'api' for the police api or 'local' for the store loaded by local_store.py
+CRIME_BACKEND = os.environ.get('CRIME_BACKEND', 'api')
 
 
-police = PoliceAPI()
-# Get the date range of data
-dt_range = police.get_dates()
+# Pooled, rate limited client shared by all callbacks
+police = make_police_api()
+metrics.instrument_police(police)
+# Dates and police forces come from a local snapshot refreshed in the background, see start_background
+reference = ReferenceData(police)
+# Indexed force and neighbourhood lookups shared by the callbacks
+catalogue = Catalogue(police, reference, crime_cache)
+local_store = LocalCrimeStore() if CRIME_BACKEND == 'local' else None
+# Monthly counts per neighbourhood and category behind the trend chart
+rollups = CrimeRollups()
+# Slow crime queries run in the background, adjacent months are prefetched after each view
+jobs = JobRunner()
+# National and new month rollups have their own threads, so they never hold up crime queries
+rollup_jobs = JobRunner(max_workers=ROLLUP_JOB_WORKERS)
+prefetch_executor = ThreadPoolExecutor(max_workers=2)
+# Pieces of areas over the api's crime cap, shared by every query so splits can not multiply threads
+split_executor = ThreadPoolExecutor(max_workers=MAX_SPLIT_WORKERS)
 
 def format_date_range(date_range):
     month_dict = {1:'Jan', 2:'Feb', 3:'Mar', 4:'Apr', 5:'May', 6:'Jun', 7:'Jul', 8:'Aug', 9:'Sep', 10:'Oct', 11:'Nov', 12:'Dec'}
@@ -59,84 +120,436 @@ def format_date_range(date_range):
         new_date_range.append((dt))
     return new_date_range
 
-new_dt_range = format_date_range((dt_range))
-date_range = dict(zip(new_dt_range, dt_range))
-date_dropdown = [{'label':str(k), 'value':str(v)} for k, v in date_range.items()]
+def crime_dates():
+    """
+    Months with crime data, newest first. In local mode these are the months loaded
+    into the local store, boundaries and the force list still come from the police api.
+    """
+    return local_store.months() if local_store is not None else reference.dates
+
+def date_dropdown():
+    dt_range = crime_dates()
+    new_dt_range = format_date_range((dt_range))
+    date_range = dict(zip(new_dt_range, dt_range))
+    return [{'label':str(k), 'value':str(v)} for k, v in date_range.items()]
 
-# Get the police force
-police_forces = police.get_forces()
-police_force_list =[{'label':p.name, 'value':p.name} for p in police_forces]
+def police_force_list():
+    return [{'label':p['name'], 'value':p['name']} for p in reference.forces]
 
 def get_police_force_id(police_name):
     """A function to return the police id in str data format."""
-    police_id = [p.id for p in police_forces if p.name == police_name]
-    if police_id != []:
-        return police_id[0]
-    else:
-        return None
+    return catalogue.force_id(police_name)
 
 # Get neighbourhood boundary for finding crime
-@cache.memoize(10)
 def get_neighbourhood_id(police_name, neighbourhood_name):
-    force_id = get_police_force_id(police_name)
-    neighbourhoods_police = police.get_force(force_id).neighbourhoods
-    neighbourhood = [n.id for n in neighbourhoods_police if n.name==neighbourhood_name]
-    if neighbourhood != []:
-        return neighbourhood[0]
+    return catalogue.neighbourhood_id(get_police_force_id(police_name), neighbourhood_name)
 
-@cache.memoize(10)
 def get_neighbourhood_boundary(police_name, neighbourhood_name):
     if (police_name is not None) and (neighbourhood_name is not None):
         police_id = get_police_force_id(police_name)
         neighbourhood_id = get_neighbourhood_id(police_name, neighbourhood_name)
-        neighbourhood = police.get_neighbourhood(police_id, neighbourhood_id)
-        return neighbourhood.boundary
+        return catalogue.boundary(police_id, neighbourhood_id)
     else:
         return None
 
 
-@cache.memoize(10)
 def get_neighbourhood_centre(police_name, neighbourhood_name):
     if (police_name is not None) and (neighbourhood_name is not None):
         police_id = get_police_force_id(police_name)
         neighbourhood_id = get_neighbourhood_id(police_name, neighbourhood_name)
-        neighbourhood = police.get_neighbourhood(police_id, neighbourhood_id)
-        coords = {'lon':neighbourhood.centre['longitude'], 'lat':neighbourhood.centre['latitude']}
-        return coords
+        return catalogue.centre(police_id, neighbourhood_id)
     else:
         return {'lon':-2, 'lat':54.5} # approx centre of GB.
 
-@cache.memoize(10)
 def create_data_dict(column_heading_list, crime_object_list):
-    crime_data = []
+    """
+    Function to build columnar crime data straight from the api results.
+    Returns dictionary of column heading and list of values as key value pair.
+    Not memoized, its result is kept in the crime cache under the neighbourhood and month.
+    """
+    columns = [[], [], [], [], []]
     for c in crime_object_list:
-        data = [c.month, c.category.name, c.location.name, c.location.latitude, c.location.longitude]
-        interim_dict = dict(zip(column_heading_list, data))
-        crime_data.append(interim_dict)
-    if crime_data != []:
-        return crime_data
+        columns[0].append(c.month)
+        columns[1].append(c.category.name)
+        columns[2].append(c.location.name)
+        columns[3].append(float(c.location.latitude))
+        columns[4].append(float(c.location.longitude))
+    if columns[0] != []:
+        return dict(zip(column_heading_list, columns))
+    else:
+        return None
+
+def create_crime_frame(crime_data):
+    """
+    Function to turn columnar crime data into a dataframe with numpy float
+    coordinates and categorical month and category columns.
+    """
+    df = pd.DataFrame({
+        'Crime Month':pd.Categorical(crime_data['Crime Month']),
+        'Crime Category':pd.Categorical(crime_data['Crime Category']),
+        'Location Name':crime_data['Location Name'],
+        'Latitude':np.asarray(crime_data['Latitude'], dtype=float),
+        'Longitude':np.asarray(crime_data['Longitude'], dtype=float)},
+        columns=COLUMN_HEADING)
+    return df.dropna()
+
+def get_crimes_area(boundary, crime_date):
+    """
+    Function to fetch the crime objects inside a boundary for one month.
+    The police api answers 503 when an area holds more than 10,000 crimes, so
+    the boundary is split into pieces level by level, and every level is fetched
+    on the one shared split pool whatever the number of concurrent queries.
+    The api also answers 503 when it is down, so splitting stops once every piece
+    of a level still answers 503, smaller pieces of a dense area would not.
+    """
+    try:
+        return police.get_crimes_area(boundary, date=crime_date)
+    except APIError as e:
+        if e.status_code != 503:
+            raise
+        unavailable = e
+
+    def fetch_piece(piece, depth):
+        try:
+            return police.get_crimes_area(piece, date=crime_date)
+        except APIError as e:
+            if e.status_code != 503 or depth >= MAX_SPLIT_DEPTH:
+                raise
+            return None # still too many crimes, split again
+
+    crimes = {} # pieces overlap slightly, keep one of each crime
+    pieces, depth = split_polygon(boundary), 1
+    while pieces != []:
+        results = list(split_executor.map(lambda p: fetch_piece(p, depth), pieces))
+        if all(r is None for r in results):
+            raise unavailable
+        next_pieces = []
+        for piece, piece_crimes in zip(pieces, results):
+            if piece_crimes is None:
+                next_pieces += split_polygon(piece)
+            else:
+                for c in piece_crimes:
+                    crimes.setdefault(c.id, c)
+        pieces, depth = next_pieces, depth + 1
+    return list(crimes.values())
+
+def get_crimes(police_name, neighbourhood_name, crime_date):
+    """
+    Function to fetch the crime table for a neighbourhood and month once.
+    The map and the table both read it from the shared crime cache.
+    """
+    police_id = get_police_force_id(police_name)
+    neighbourhood_id = get_neighbourhood_id(police_name, neighbourhood_name)
+    return get_neighbourhood_crimes(police_id, neighbourhood_id, crime_date)
+
+def get_neighbourhood_crimes(police_id, neighbourhood_id, crime_date):
+    """
+    Function to fetch the crime table by police and neighbourhood id.
+    Used directly by jobs which walk the catalogue rather than the dropdown names.
+    """
+    if local_store is not None:
+        neighbourhood_boundary = catalogue.boundary(police_id, neighbourhood_id)
+        return local_store.get_crimes_area(neighbourhood_boundary, crime_date, COLUMN_HEADING)
+
+    def fetch():
+        neighbourhood_boundary = catalogue.boundary(police_id, neighbourhood_id)
+        crimes = get_crimes_area(neighbourhood_boundary, crime_date)
+        return create_data_dict(COLUMN_HEADING, crimes)
+
+    ttl = PUBLISHED_MONTH_TTL if is_published(crime_date) else LATEST_MONTH_TTL
+    return crime_cache.get_or_fetch(crime_data_key(police_id, neighbourhood_id, crime_date), fetch, ttl)
+
+def is_published(crime_date):
+    """Months before the latest never change, the latest month may still be revised."""
+    return crime_date in crime_dates()[1:]
+
+def rollup_ttl(crime_date):
+    """The latest month is counted again once its crime cache entry could have expired."""
+    return None if is_published(crime_date) else LATEST_MONTH_TTL
+
+def crime_data_key(police_id, neighbourhood_id, crime_date):
+    return f'crime_data:{police_id}:{neighbourhood_id}:{crime_date}'
+
+def month_range(start_month, end_month=None):
+    """
+    Function to list every month from start_month to end_month inclusive.
+    Months are in YYYY-MM format, returned oldest first.
+    """
+    if end_month is None:
+        return [start_month]
+    start_month, end_month = sorted([start_month, end_month])
+    year, month = [int(i) for i in start_month.split('-')]
+    months = []
+    while f'{year}-{month:02d}' <= end_month:
+        months.append(f'{year}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def period_label(months):
+    if len(months) == 1:
+        return months[0]
+    return f'{months[0]} to {months[-1]}'
+
+def get_crimes_range(police_name, neighbourhood_name, months):
+    """
+    Function to fetch the crime table for several months concurrently.
+    Each month goes through the per month cache, so months already seen are not fetched again.
+    """
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(months))) as executor:
+        tables = [t for t in executor.map(lambda m: get_crimes(police_name, neighbourhood_name, m), months) if t is not None]
+    if len(tables) == 1:
+        return tables[0]
+    elif tables != []:
+        return {h:[v for t in tables for v in t[h]] for h in COLUMN_HEADING}
     else:
         return None
 
-@cache.memoize(10)
-def calculate_crime_summary(SUMMARY_HEADING, df):
+@cached_query(cache, 60)
+def get_crime_frame(police_name, neighbourhood_name, months):
+    """
+    Function to return the crime dataframe for a neighbourhood and month range,
+    kept briefly so table paging does not rebuild it for every page.
+    """
+    table = get_crimes_range(police_name, neighbourhood_name, months)
+    if table is not None:
+        return create_crime_frame(table)
+    else:
+        return None
+
+def update_rollups(police_id, neighbourhood_id, months):
+    """
+    Function to aggregate the months missing from the rollup table.
+    Months already rolled up are never fetched or counted again.
+    """
+    missing = [m for m in months if m not in rollups.months(police_id, neighbourhood_id)]
+    if missing == []:
+        return
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(missing))) as executor:
+        tables = list(executor.map(lambda m: get_neighbourhood_crimes(police_id, neighbourhood_id, m), missing))
+    for month, table in zip(missing, tables):
+        counts = pd.Series(table['Crime Category']).value_counts().to_dict() if table is not None else {}
+        rollups.add_month(police_id, neighbourhood_id, month, counts, rollup_ttl(month))
+
+def generate_trend(police_name, neighbourhood_name):
+    """
+    Function to build the monthly crime trend chart of a neighbourhood from the rollup table.
+    """
+    months = sorted(crime_dates()[:TREND_MONTHS])
+    police_id = get_police_force_id(police_name)
+    neighbourhood_id = get_neighbourhood_id(police_name, neighbourhood_name)
+    rollups.track(police_id, neighbourhood_id) # kept up to date as months are published
+    update_rollups(police_id, neighbourhood_id, months)
+    trend = pd.DataFrame(rollups.trend(police_id, neighbourhood_id, months), columns=['Month', 'Crime Category', 'Total'])
+    trend = trend.pivot(index='Month', columns='Crime Category', values='Total').reindex(months).fillna(0)
+    figure = dict(
+        data=[
+            {
+                'type':'scatter',
+                'x':trend.index,
+                'y':trend[c],
+                'mode':'lines+markers',
+                'name':c,
+                'line':{'color':CRIME_CATEGORY_COLOUR.get(c)}
+            } for c in trend.columns],
+        layout=dict(
+            height=400,
+            font=dict(color="#fffcfc"),
+            margin=dict(
+                    l=35,
+                    r=15,
+                    b=35,
+                    t=45),
+            hovermode="closest",
+            plot_bgcolor='#191A1A',
+            paper_bgcolor='#020202',
+            title='Monthly Trend',
+            showlegend=False,
+            yaxis=dict(rangemode='tozero')
+        )
+    )
+    return figure
+
+def store_overview_shape(police_id, neighbourhood_id, boundary=None):
+    """Stores the simplified neighbourhood boundary drawn on the overview map."""
+    if boundary is None:
+        boundary = catalogue.boundary_once(police_id, neighbourhood_id)
+    rollups.add_shape(police_id, neighbourhood_id, simplify_polygon(boundary, OVERVIEW_TOLERANCE))
+
+def rollup_neighbourhood(police_id, neighbourhood_id, month, boundary=None):
+    """
+    Function to count one month of a neighbourhood's crimes into the rollup table.
+    Crimes already in the crime cache are counted from there, any others are counted
+    straight from the api, and neither the crimes nor the boundary are cached, so a
+    national run does not flush the cache or fill the worker's memory.
+    """
+    if month in rollups.months(police_id, neighbourhood_id):
+        return
+    missing = object()
+    if local_store is not None:
+        table = get_neighbourhood_crimes(police_id, neighbourhood_id, month)
+    else:
+        table = crime_cache.get(crime_data_key(police_id, neighbourhood_id, month), missing)
+    if table is missing:
+        if boundary is None:
+            boundary = catalogue.boundary_once(police_id, neighbourhood_id)
+        crimes = get_crimes_area(boundary, month)
+        counts = Counter(c.category.name for c in crimes)
+    elif table is not None:
+        counts = pd.Series(table['Crime Category']).value_counts().to_dict()
+    else:
+        counts = {}
+    rollups.add_month(police_id, neighbourhood_id, month, counts, rollup_ttl(month))
+
+def aggregate_neighbourhood(police_id, neighbourhood_id, month):
+    """Adds one neighbourhood and month to the overview map."""
+    boundary = catalogue.boundary_once(police_id, neighbourhood_id) # only the simplified shape is kept
+    store_overview_shape(police_id, neighbourhood_id, boundary)
+    rollup_neighbourhood(police_id, neighbourhood_id, month, boundary)
+
+def aggregate_national(job, month):
+    """
+    Background job rolling up one month for every neighbourhood in England and Wales,
+    NATIONAL_WORKERS neighbourhoods at a time, for the overview map.
+    Neighbourhoods aggregated by an earlier run are skipped.
+    """
+    job.progress(0, 'Loading neighbourhoods')
+    force_ids = [f['id'] for f in reference.forces]
+    with ThreadPoolExecutor(max_workers=NATIONAL_WORKERS) as executor:
+        neighbourhoods = list(executor.map(catalogue.neighbourhoods, force_ids))
+        done = rollups.aggregated(month) & set(rollups.shapes())
+        tasks = [(f, n['id']) for f, ns in zip(force_ids, neighbourhoods) for n in ns if (f, n['id']) not in done]
+        futures = [executor.submit(aggregate_neighbourhood, p, n, month) for p, n in tasks]
+        failed = 0
+        try:
+            for i, future in enumerate(as_completed(futures), 1):
+                if future.exception() is not None:
+                    failed += 1
+                job.progress(i / len(futures), f'Aggregated {i} of {len(futures)} neighbourhoods, {failed} failed')
+        finally:
+            for future in futures:
+                future.cancel()
+
+def rollup_new_months(job, new_months):
+    """
+    Background job adding newly published months to the rollups. Neighbourhoods whose
+    trend has been viewed go through the crime cache, those only on the overview map
+    are counted without caching them.
+    """
+    tracked = set(rollups.tracked())
+    tasks = [(update_rollups, p, n, new_months) for p, n in tracked]
+    tasks += [(rollup_neighbourhood, p, n, m) for p, n in rollups.shapes() if (p, n) not in tracked for m in new_months]
+    with ThreadPoolExecutor(max_workers=NATIONAL_WORKERS) as executor:
+        futures = [executor.submit(*t) for t in tasks]
+        try:
+            for i, future in enumerate(as_completed(futures), 1):
+                job.progress(i / len(futures), f'Rolled up {i} of {len(futures)} neighbourhoods')
+        finally:
+            for future in futures:
+                future.cancel()
+
+def start_rollup_new_months(new_months):
+    """Called by the reference refresh, only the first worker to see the new months rolls them up."""
+    if rollups.claim_months(new_months):
+        rollup_jobs.submit(rollup_new_months, new_months)
+
+def start_aggregate_national(month):
+    """
+    Starts aggregating the month unless another visitor's aggregation of it is still
+    running, returns the id of the job doing it.
+    """
+    job_id = rollup_jobs.create()
+    running = lambda other:(rollup_jobs.status(other) or {}).get('status') in ['queued', 'running']
+    claimed = rollups.claim_job(f'national:{month}', job_id, running)
+    if claimed == job_id:
+        rollup_jobs.start(job_id, aggregate_national, month)
+    else:
+        rollup_jobs.cancel(job_id)
+    return claimed
+
+def prefetch_adjacent_months(police_id, neighbourhood_id, months):
+    """Speculatively fetches the months either side of the viewed range into the crime cache."""
+    available = sorted(crime_dates())
+    adjacent = []
+    if months[0] in available and available.index(months[0]) > 0:
+        adjacent.append(available[available.index(months[0]) - 1])
+    if months[-1] in available and available.index(months[-1]) < len(available) - 1:
+        adjacent.append(available[available.index(months[-1]) + 1])
+    for month in adjacent:
+        prefetch_executor.submit(get_neighbourhood_crimes, police_id, neighbourhood_id, month)
+
+def fetch_crime_data(job, police_name, neighbourhood_name, months):
+    """
+    Background job fetching everything the map and table need for a query,
+    reporting progress as each month arrives.
+    """
+    police_id = get_police_force_id(police_name)
+    neighbourhood_id = get_neighbourhood_id(police_name, neighbourhood_name)
+    steps = len(months) + 2
+    job.progress(0, 'Loading neighbourhood')
+    catalogue.boundary(police_id, neighbourhood_id)
+    catalogue.centre(police_id, neighbourhood_id)
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(months))) as executor:
+        futures = [executor.submit(get_neighbourhood_crimes, police_id, neighbourhood_id, m) for m in months]
+        try:
+            for i, future in enumerate(as_completed(futures), 1):
+                future.result()
+                job.progress(i / steps, f'Fetched {i} of {len(months)} months')
+        finally:
+            for future in futures:
+                future.cancel()
+    job.progress((steps - 1) / steps, 'Updating monthly trend')
+    update_rollups(police_id, neighbourhood_id, sorted(crime_dates()[:TREND_MONTHS]))
+    prefetch_adjacent_months(police_id, neighbourhood_id, months)
+
+@cached_query(cache, 10)
+def calculate_crime_summary(police_name, neighbourhood_name, months):
     """
     Function to calculate total of each type of crime
     Returns dictionary of crimetype and total as key value pair.
     """
+    df = get_crime_frame(police_name, neighbourhood_name, months)
+    if df is None:
+        return None
     data = []
-    crime_dictionary = df['Crime Category'].value_counts().to_dict()
-    for k, v in crime_dictionary.items():
-        interim_dict ={f'{SUMMARY_HEADING[0]}':k, f'{SUMMARY_HEADING[1]}':v}
+    crime_counts = df['Crime Category'].value_counts()
+    crime_counts = crime_counts[crime_counts > 0] # categorical counts include unused categories
+    for k, v in zip(crime_counts.index, crime_counts.values):
+        interim_dict ={f'{SUMMARY_HEADING[0]}':k, f'{SUMMARY_HEADING[1]}':int(v)}
         data.append(interim_dict)
     if data != []:
         return data
     else:
         return None
 
-@cache.memoize(10)
-def generate_map(n_clicks=None, police_force_dropdown=None, neighbourhood_dropdown=None, crime_date_dropdown=None):
-    if n_clicks is None and police_force_dropdown is None and neighbourhood_dropdown is None and crime_date_dropdown is None:
+def degrees_per_pixel(zoom):
+    return 360 / (256 * 2 ** zoom)
+
+def cluster_crimes(df, zoom):
+    """
+    Function to aggregate crimes into map markers for a zoom level.
+    Crimes sharing an anonymised location are always drawn as one marker, and
+    below CLUSTER_MAX_ZOOM nearby locations are binned into grid cells per category.
+    Returns dataframe of Latitude, Longitude, Crime Category, Location Name and Count.
+    """
+    if zoom >= CLUSTER_MAX_ZOOM:
+        keys = [df['Latitude'], df['Longitude']]
+    else:
+        cell_size = degrees_per_pixel(zoom) * CLUSTER_CELL_PIXELS
+        keys = [np.floor(df['Latitude'] / cell_size), np.floor(df['Longitude'] / cell_size)]
+    clusters = df.groupby(keys + [df['Crime Category']], observed=True, sort=False).agg(
+        Latitude=('Latitude', 'mean'),
+        Longitude=('Longitude', 'mean'),
+        Location=('Location Name', 'first'),
+        Count=('Location Name', 'size'),
+        Locations=('Location Name', 'nunique'))
+    clusters = clusters.reset_index(level=-1).reset_index(drop=True)
+    clusters['Location Name'] = clusters['Location'].where(clusters['Locations'] == 1, clusters['Locations'].astype(str) + ' locations')
+    return clusters[['Latitude', 'Longitude', 'Crime Category', 'Location Name', 'Count']]
+
+@cached_query(cache, 10)
+def generate_map(n_clicks=None, police_force_dropdown=None, neighbourhood_dropdown=None, crime_date_dropdown=None, crime_date_end_dropdown=None, zoom=MAP_ZOOM):
+    if police_force_dropdown is None or neighbourhood_dropdown is None or crime_date_dropdown is None:
+        # startup map, also shown when a query is submitted without every parameter
         startup_map = dict(
                         data =[{
                             'type':'scattermapbox',
@@ -158,6 +571,7 @@ def generate_map(n_clicks=None, police_force_dropdown=None, neighbourhood_dropdo
                                 plot_bgcolor='#191A1A',
                                 paper_bgcolor='#020202',
                                 title='Waiting for all user parameters',
+                                uirevision='startup', # keeps the user's pan and zoom
                                 legend=dict(
                                     font=dict(color="#fffcfc",size=10),
                                     orientation='h'),
@@ -173,115 +587,123 @@ def generate_map(n_clicks=None, police_force_dropdown=None, neighbourhood_dropdo
             )
         return startup_map
     else:
-        if police_force_dropdown is not None and neighbourhood_dropdown is not None and crime_date_dropdown is not None:
-            neighbourhood_boundary = get_neighbourhood_boundary(police_force_dropdown, neighbourhood_dropdown)
-            crimes = police.get_crimes_area(neighbourhood_boundary, date=crime_date_dropdown)
-            table = create_data_dict(COLUMN_HEADING, crimes)
-            neighbourhood_centre = get_neighbourhood_centre(police_force_dropdown, neighbourhood_dropdown)
-            if table is not None:
-                df = pd.DataFrame(table).dropna()
-                figure = dict(
-                    data =[
-                        # Anonymised crime location layer
-                        {
-                            'type':'scattermapbox',
-                            'lat':df['Latitude'],
-                            'lon':df['Longitude'],
-                            'mode':'markers',
-                            'marker':{
-                                'color':[CRIME_CATEGORY_COLOUR[d] for d in df['Crime Category']]
-                            },
-                            'text':[[f"Crime Category:{c}<br>Location:{l}"]for c, l in zip(df['Crime Category'], df['Location Name'])],
-                            'name':'Anonymised Crime Location'
+        neighbourhood_boundary = get_neighbourhood_boundary(police_force_dropdown, neighbourhood_dropdown)
+        months = month_range(crime_date_dropdown, crime_date_end_dropdown)
+        df = get_crime_frame(police_force_dropdown, neighbourhood_dropdown, months)
+        neighbourhood_centre = get_neighbourhood_centre(police_force_dropdown, neighbourhood_dropdown)
+        if df is not None:
+            clusters = cluster_crimes(df, zoom)
+            # Boundary detail finer than a pixel at this zoom is not visible
+            neighbourhood_boundary = simplify_polygon(neighbourhood_boundary, degrees_per_pixel(zoom))
+            figure = dict(
+                data =[
+                    # Anonymised crime location layers, one trace per category so the browser can
+                    # filter and highlight categories, one marker per location or cluster sized by count
+                    {
+                        'type':'scattermapbox',
+                        'lat':group['Latitude'],
+                        'lon':group['Longitude'],
+                        'mode':'markers',
+                        'marker':{
+                            'color':CRIME_CATEGORY_COLOUR.get(category),
+                            'size':np.minimum(6 + 3 * np.sqrt(group['Count'] - 1), 30).round(1)
                         },
-                        ## The neighbourhood boundary layer
-                        {
-                            'type':'scattermapbox',
-                            'lat':[coord[0] for coord in neighbourhood_boundary],
-                            'lon':[coord[1] for coord in neighbourhood_boundary],
-                            'mode':'lines',
-                            'name':f'{neighbourhood_dropdown} neighbourhood boundary',
-                            'hoverinfo':'text'
-                        }],
-                    layout=dict(
-                            # autosize=True,
-                            # height=500,
-                            font=dict(color="#fffcfc"),
-                            titlefont=dict(color="#fffcfc", size='14'),
-                            margin=dict(
-                                    l=35,
-                                    r=35,
-                                    b=35,
-                                    t=45),
-                            hovermode="closest",
-                            plot_bgcolor='#191A1A',
-                            paper_bgcolor='#020202',
-                            showlegend=True, # need to improve here
-                            legend=dict(
-                                    font=dict(color="#fffcfc",size=10),
-                                    orientation='h'),
-                            title='Anonymised Crime Location',
-                            mapbox=dict(
-                                    accesstoken=MAPBOX,
-                                    style="dark",
-                                    center=dict(
-                                            lon=neighbourhood_centre['lon'],
-                                            lat=neighbourhood_centre['lat']
-                                    ),
-                                    zoom=12
-                            )
-                        )
-                )
-                return figure
-            else:  # return this data when no crime data found.
-                no_data = dict(
-                    data =[
-                        {'type':'scattermapbox',
-                        'lat':neighbourhood_centre['lon'],
-                        'lon':neighbourhood_centre['lat'],
-                        'mode':'markers'
-                        }],
-                    layout=dict(
-                        autosize=True,
-                        height=500,
-                        font=dict(color="#191A1A"),
-                        titlefont=dict(color="#191A1A", size='14'),
+                        'text':f'Crime Category:{category}<br>Location:' + group['Location Name'] + '<br>Crimes:' + group['Count'].astype(str),
+                        'name':category,
+                        'meta':'crime_category'
+                    } for category, group in clusters.groupby('Crime Category', observed=True)] + [
+                    ## The neighbourhood boundary layer
+                    {
+                        'type':'scattermapbox',
+                        'lat':[coord[0] for coord in neighbourhood_boundary],
+                        'lon':[coord[1] for coord in neighbourhood_boundary],
+                        'mode':'lines',
+                        'name':f'{neighbourhood_dropdown} neighbourhood boundary',
+                        'hoverinfo':'text'
+                    }],
+                layout=dict(
+                        # autosize=True,
+                        # height=500,
+                        font=dict(color="#fffcfc"),
+                        titlefont=dict(color="#fffcfc", size='14'),
                         margin=dict(
                                 l=35,
                                 r=35,
                                 b=35,
                                 t=45),
                         hovermode="closest",
-                        plot_bgcolor='#fffcfc',
-                        paper_bgcolor='#fffcfc',
-                        title=f'No crime in {crime_date_dropdown}.',
+                        plot_bgcolor='#191A1A',
+                        paper_bgcolor='#020202',
+                        showlegend=True, # need to improve here
                         legend=dict(
-                                    font=dict(color="#fffcfc",size=10),
-                                    orientation='h'),
+                                font=dict(color="#fffcfc",size=10),
+                                orientation='h'),
+                        title='Anonymised Crime Location',
+                        # keeps the user's pan and zoom when the clusters are redrawn
+                        uirevision=f'{police_force_dropdown}:{neighbourhood_dropdown}:{period_label(months)}:{n_clicks}',
                         mapbox=dict(
                                 accesstoken=MAPBOX,
-                                style="light",
+                                style="dark",
                                 center=dict(
                                         lon=neighbourhood_centre['lon'],
                                         lat=neighbourhood_centre['lat']
-                                        ),
-                                zoom=12,
-                                )
+                                ),
+                                zoom=MAP_ZOOM
                         )
-                )
-                return no_data
+                    )
+            )
+            return figure
+        else:  # return this data when no crime data found.
+            no_data = dict(
+                data =[
+                    {'type':'scattermapbox',
+                    'lat':neighbourhood_centre['lon'],
+                    'lon':neighbourhood_centre['lat'],
+                    'mode':'markers'
+                    }],
+                layout=dict(
+                    autosize=True,
+                    height=500,
+                    font=dict(color="#191A1A"),
+                    titlefont=dict(color="#191A1A", size='14'),
+                    margin=dict(
+                            l=35,
+                            r=35,
+                            b=35,
+                            t=45),
+                    hovermode="closest",
+                    plot_bgcolor='#fffcfc',
+                    paper_bgcolor='#fffcfc',
+                    title=f'No crime in {period_label(months)}.',
+                    uirevision=f'{police_force_dropdown}:{neighbourhood_dropdown}:{period_label(months)}:{n_clicks}',
+                    legend=dict(
+                                font=dict(color="#fffcfc",size=10),
+                                orientation='h'),
+                    mapbox=dict(
+                            accesstoken=MAPBOX,
+                            style="light",
+                            center=dict(
+                                    lon=neighbourhood_centre['lon'],
+                                    lat=neighbourhood_centre['lat']
+                                    ),
+                            zoom=12,
+                            )
+                    )
+            )
+            return no_data
 
 
-@cache.memoize(10)
-def generate_crime_table(n_clicks=None, police_force_dropdown=None, neighbourhood_dropdown=None, crime_date_dropdown=None):
+@cached_query(cache, 10)
+def generate_crime_table(n_clicks=None, police_force_dropdown=None, neighbourhood_dropdown=None, crime_date_dropdown=None, crime_date_end_dropdown=None):
     if police_force_dropdown is not None and neighbourhood_dropdown is not None and crime_date_dropdown is not None:
-        neighbourhood_boundary = get_neighbourhood_boundary(police_force_dropdown, neighbourhood_dropdown)
-        crimes = police.get_crimes_area(neighbourhood_boundary, date=crime_date_dropdown)
-        table = create_data_dict(COLUMN_HEADING, crimes)
-        if table is not None:
-            df = pd.DataFrame(table).dropna()
-            crime_counts = calculate_crime_summary(SUMMARY_HEADING, df)
+        months = month_range(crime_date_dropdown, crime_date_end_dropdown)
+        df = get_crime_frame(police_force_dropdown, neighbourhood_dropdown, months)
+        if df is not None:
+            crime_counts = calculate_crime_summary(police_force_dropdown, neighbourhood_dropdown, months)
+            page, page_count = table_page(df, 0, CRIME_TABLE_PAGE_SIZE)
             table_div = [
+                    # The query behind the table, read back when the table asks for another page
+                    dcc.Store(id='crime_query', data={'police_force':police_force_dropdown, 'neighbourhood':neighbourhood_dropdown, 'months':months}),
                     html.Div([
                         html.Div(html.H4('Crime Data'), className='eight columns', style={'textAlign':'center','fontFamily':'nunito'}),
                         html.Div(html.H4('Summary'), className='four columns', style={'textAlign':'center','fontFamily':'nunito'})], className='row'),
@@ -289,14 +711,20 @@ def generate_crime_table(n_clicks=None, police_force_dropdown=None, neighbourhoo
                             html.Div(
                                 dash_table.DataTable(
                                     id='crime_table',
-                                    columns = [{'name':i, 'id':i} for i in COLUMN_HEADING],
-                                    sort_action='native',
-                                    filter_action='native',
+                                    columns = [{'name':i, 'id':i, 'type':'numeric' if i in ['Latitude', 'Longitude'] else 'text'} for i in COLUMN_HEADING],
+                                    page_action='custom',
+                                    sort_action='custom',
+                                    sort_mode='multi',
+                                    sort_by=[],
+                                    filter_action='custom',
+                                    filter_query='',
                                     row_selectable='multi',
                                     fixed_rows=1,
                                     selected_rows=[],
-                                    data=table,
-                                    page_size=15,
+                                    data=page,
+                                    page_current=0,
+                                    page_count=page_count,
+                                    page_size=CRIME_TABLE_PAGE_SIZE,
                                     style_header={
                                         'backgroundColor':'#a9c1a1',
                                         'fontWeight':'bold',
@@ -311,7 +739,7 @@ def generate_crime_table(n_clicks=None, police_force_dropdown=None, neighbourhoo
                                         'maxHeight':'500',
                                         'overflowY':'scroll',
                                         'overflowX':'scroll'}), className='eight columns'),
-                            html.Div(
+                            html.Div([
                                 dash_table.DataTable(
                                     id='crime_summary',
                                     columns = [{'name':i, 'id':i} for i in SUMMARY_HEADING],
@@ -329,65 +757,243 @@ def generate_crime_table(n_clicks=None, police_force_dropdown=None, neighbourhoo
                                         'overflowY':'scroll',
                                         'overflowX':'scroll'
                                     }     
-                                    ), className='four columns')], className='row')
+                                    ),
+                                dcc.Graph(
+                                    id='crime_trend',
+                                    figure=generate_trend(police_force_dropdown, neighbourhood_dropdown))
+                                ], className='four columns')], className='row'),
+                    html.Div([
+                        html.A(f'Download {f.upper()}', href=download_url(f, police_force_dropdown, neighbourhood_dropdown, months), style={'padding':'10px'})
+                        for f in EXPORT_FORMATS if f != 'parquet' or parquet_available()
+                    ], className='row', style={'fontFamily':'nunito'})
                     ]
             return table_div
         else:
-            msg = [html.H5(f'No crimes for the {crime_date_dropdown}.')]
+            msg = [html.H5(f'No crimes for the {period_label(months)}.')]
             return msg
     else:
         return None
 
+def download_url(file_format, police_name, neighbourhood_name, months):
+    query = {'force':police_name, 'neighbourhood':neighbourhood_name, 'date':months[0], 'date_end':months[-1]}
+    return f'/download/crimes.{file_format}?{urlencode(query)}'
+
+# Streams the crime data behind the table a month at a time, gzip compressed when the client accepts it
+@server.route('/download/crimes.<file_format>')
+def download_crimes(file_format):
+    police_name = request.args.get('force')
+    neighbourhood_name = request.args.get('neighbourhood')
+    crime_date = request.args.get('date')
+    crime_date_end = request.args.get('date_end', crime_date)
+    if file_format not in EXPORT_FORMATS:
+        abort(404)
+    if file_format == 'parquet' and not parquet_available():
+        abort(501, 'Parquet export needs pyarrow installed.')
+    neighbourhood_id = get_neighbourhood_id(police_name, neighbourhood_name)
+    available = crime_dates()
+    if neighbourhood_id is None or crime_date not in available or crime_date_end not in available:
+        abort(400, 'Unknown police force, neighbourhood or month.')
+    months = month_range(crime_date, crime_date_end)
+    # Each month comes from the same crime cache as the table, so viewed months are not fetched again
+    tables = (get_crimes(police_name, neighbourhood_name, m) for m in months)
+    headers = {'Content-Disposition':f'attachment; filename=crimes_{get_police_force_id(police_name)}_{neighbourhood_id}_{months[0]}_{months[-1]}.{file_format}'}
+    if file_format == 'csv':
+        chunks = csv_chunks(COLUMN_HEADING, tables)
+        headers['Vary'] = 'Accept-Encoding'
+        if 'gzip' in request.accept_encodings:
+            chunks = gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+    else:
+        chunks = parquet_chunks(COLUMN_HEADING, tables) # compressed inside the file
+    return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[file_format], headers=headers)
+
+@cached_query(cache, 60)
+def generate_overview(month=None, police_name=None, revision=None):
+    """
+    Function to build the overview choropleth of a month from the rollup table.
+    Nationally each neighbourhood is coloured by the total of its police force,
+    within a force by its own total. revision changes when an aggregation finishes.
+    """
+    police_id = get_police_force_id(police_name)
+    shapes = rollups.shapes(police_id)
+    if police_id is None:
+        force_names = {f['id']:f['name'] for f in reference.forces}
+        force_totals, top_categories = {}, {}
+        for force, category, total in rollups.force_totals(month): # largest category first
+            force_totals[force] = force_totals.get(force, 0) + total
+            top_categories.setdefault(force, []).append(f'{category}: {total}')
+        keys = [k for k in shapes if k[0] in force_totals]
+        totals = [force_totals[f] for f, _ in keys]
+        text = [f'{force_names.get(f, f)}<br>{force_totals[f]} crimes<br>' + '<br>'.join(top_categories[f][:3]) for f, _ in keys]
+        title = f'Crimes in {month} by police force, click a force to see its neighbourhoods'
+        centre, zoom = {'lon':-2, 'lat':54.5}, 5
+    else:
+        neighbourhood_totals = dict(rollups.neighbourhood_totals(month, police_id))
+        neighbourhood_names = {n['id']:n['name'] for n in catalogue.neighbourhoods(police_id)}
+        keys = [k for k in shapes if k[1] in neighbourhood_totals]
+        totals = [neighbourhood_totals[n] for _, n in keys]
+        text = [f'{neighbourhood_names.get(n, n)}<br>{neighbourhood_totals[n]} crimes' for _, n in keys]
+        title = f'Crimes in {month} by {police_name} neighbourhood, click a neighbourhood to view its crimes'
+        points = [p for k in keys for p in shapes[k]]
+        centre = {'lon':float(np.mean([p[1] for p in points])), 'lat':float(np.mean([p[0] for p in points]))} if points else {'lon':-2, 'lat':54.5}
+        zoom = 8
+    if keys == []:
+        title = f'No totals for {month} yet, press Aggregate to compute them'
+    figure = dict(
+        data=[{
+            'type':'choroplethmapbox',
+            'geojson':{
+                'type':'FeatureCollection',
+                'features':[{
+                    'type':'Feature',
+                    'id':f'{f}/{n}',
+                    'geometry':{'type':'Polygon', 'coordinates':[[[lon, lat] for lat, lon in shapes[(f, n)]]]}
+                } for f, n in keys]},
+            'locations':[f'{f}/{n}' for f, n in keys],
+            'z':totals,
+            'text':text,
+            'hoverinfo':'text',
+            'customdata':[[f, n] for f, n in keys],
+            'colorscale':'Reds',
+            'marker':{'line':{'width':0 if police_id is None else 0.5}},
+            'colorbar':{'title':'Crimes'}
+        }],
+        layout=dict(
+            height=600,
+            font=dict(color="#fffcfc"),
+            margin=dict(
+                    l=35,
+                    r=35,
+                    b=35,
+                    t=45),
+            plot_bgcolor='#191A1A',
+            paper_bgcolor='#020202',
+            title=title,
+            uirevision=f'{police_name}',
+            mapbox=dict(
+                    accesstoken=MAPBOX,
+                    style="dark",
+                    center=centre,
+                    zoom=zoom
+            )
+        )
+    )
+    return figure
+
 #################################################################################
 
-app.layout = html.Div([
+def serve_layout():
+    """Layout is built per page load so the dropdowns pick up refreshed reference data."""
+    if not reference.dates:
+        reference.wait(REFERENCE_WAIT) # a fresh dyno has no snapshot until the first refresh
+    return html.Div([
                 html.Div(id='page-title'),
+                html.Div(
+                    html.H5('Police data is still loading, please refresh the page in a moment.', style={'fontFamily':'nunito'})
+                    if not reference.dates else None),
                 html.Div(id='neighbourhood_name'),
                 html.Div([
-                        html.Div(html.H4('Select Police Area'), className='three columns', style={'width':'35%', 'display':'inline-block', 'textAlign':'center','fontFamily':'nunito'}),
-                        html.Div(html.H4('Select Police Neighbourhood'), className='three columns', style={'width':'35%', 'display':'inline-block', 'textAlign':'center','fontFamily':'nunito'}),
-                        html.Div(html.H4('Select Date'), className='two columns', style={'width':'10%', 'display':'inline-block', 'textAlign':'center','fontFamily':'nunito'})], className='row'),
+                        html.Div(html.H4('Select Police Area'), className='three columns', style={'width':'30%', 'display':'inline-block', 'textAlign':'center','fontFamily':'nunito'}),
+                        html.Div(html.H4('Select Police Neighbourhood'), className='three columns', style={'width':'30%', 'display':'inline-block', 'textAlign':'center','fontFamily':'nunito'}),
+                        html.Div(html.H4('Select Date'), className='two columns', style={'width':'10%', 'display':'inline-block', 'textAlign':'center','fontFamily':'nunito'}),
+                        html.Div(html.H4('To (optional)'), className='two columns', style={'width':'10%', 'display':'inline-block', 'textAlign':'center','fontFamily':'nunito'})], className='row'),
                 html.Div([
                     html.Div([dcc.Dropdown(
                         id='police_force_dropdown',
-                        options=police_force_list,
+                        options=police_force_list(),
                         placeholder='Select a Police Force....',
                         value=None
-                    )], className='three columns', style={'width':'35%', 'display':'inline-block'}),
+                    )], className='three columns', style={'width':'30%', 'display':'inline-block'}),
                     html.Div([dcc.Dropdown(
                         id='police_neighbourhood',
                         placeholder ='Select Police Neighbourhood'
                            )
-                    ], className='three columns', style={'width':'35%', 'display':'inline-block'}),
+                    ], className='three columns', style={'width':'30%', 'display':'inline-block'}),
                     html.Div([
                     dcc.Dropdown(
                         id='crime_date',
-                        options=date_dropdown,
+                        options=date_dropdown(),
                         multi=False,
                         value=None,
                         clearable=False
                     )],className='two columns', style={'width':'10%', 'display':'inline-block'}),
+                    html.Div([
+                    dcc.Dropdown(
+                        id='crime_date_end',
+                        options=date_dropdown(),
+                        multi=False,
+                        value=None,
+                        placeholder='Single month'
+                    )],className='two columns', style={'width':'10%', 'display':'inline-block'}),
                     html.Div([
                         html.Button(id='submit_button', children='Submit', style={'fontFamily':'nunito'})
                     ],className='one column')
                 ], className='row'),
+                html.Div([
+                    html.Div([dcc.Checklist(
+                        id='category_filter',
+                        options=[{'label':c, 'value':c} for c in sorted(CRIME_CATEGORY_COLOUR)],
+                        value=sorted(CRIME_CATEGORY_COLOUR),
+                        labelStyle={'display':'inline-block', 'padding':'0 8px'}
+                    )], className='nine columns', style={'fontFamily':'nunito'}),
+                    html.Div([dcc.Dropdown(
+                        id='category_highlight',
+                        options=[{'label':c, 'value':c} for c in sorted(CRIME_CATEGORY_COLOUR)],
+                        placeholder='Highlight a category'
+                    )], className='three columns')
+                ], className='row'),
                 html.Div(
                     [
                         dcc.Graph(
                             id='crime_map',
-                            figure=generate_map(),
                             config={'scrollZoom':True},
                             style={'marginTop':'10', 'marginBottom':'10'})
                     ], className='row twelve columns'
                 ),
+                # The server only ships the map traces, filtering and highlighting run in the browser
+                dcc.Store(id='map_figure', data=generate_map()),
+                dcc.Store(id='selected_crimes', data=[]),
+                dcc.Store(id='map_query'),
+                dcc.Store(id='crime_job'),
+                dcc.Store(id='crime_ready'),
+                dcc.Interval(id='job_interval', interval=JOB_POLL_INTERVAL, disabled=True),
+                html.Div([
+                    html.Div(id='job_status', style={'display':'inline-block'}),
+                    html.Button(id='cancel_button', children='Cancel', style={'display':'none'})
+                ], className='row', style={'textAlign':'center'}),
                 html.Div(
                     id='crime_div',
                     className='row'),
+                html.Div([
+                        html.Div(html.H4('Overview'), className='three columns', style={'textAlign':'center','fontFamily':'nunito'}),
+                        html.Div([dcc.Dropdown(
+                            id='overview_month',
+                            options=date_dropdown(),
+                            value=(crime_dates() or [None])[0],
+                            clearable=False
+                        )], className='two columns'),
+                        html.Div([
+                            html.Button(id='aggregate_button', children='Aggregate', style={'fontFamily':'nunito'})
+                        ], className='two columns'),
+                        html.Div(id='aggregate_status', className='five columns')
+                ], className='row'),
+                html.Div(
+                    [
+                        dcc.Graph(
+                            id='overview_map',
+                            config={'scrollZoom':True})
+                    ], className='row twelve columns'
+                ),
+                dcc.Store(id='aggregate_job'),
+                dcc.Store(id='aggregate_ready'),
+                dcc.Interval(id='aggregate_interval', interval=JOB_POLL_INTERVAL, disabled=True),
                 html.Div(
                     id='social_media',
                     className='row',
                     style={'width':'100%', 'text-align':'center'})
-])
+    ])
+
+app.layout = serve_layout
 
 
 # Callback to update the page title of police force
@@ -426,35 +1032,185 @@ def populate_police_neighbourhood(selected_police_force):
     """
     if selected_police_force is not None:
         police_id = get_police_force_id(selected_police_force)
-        police_neighbourhoods = list({'label':n.name, 'value':n.name} for n in police.get_neighbourhoods(police_id))
+        police_neighbourhoods = list({'label':n['name'], 'value':n['name']} for n in catalogue.neighbourhoods(police_id))
         return police_neighbourhoods
     else:
         return list()
 
-# Callback to create crime table  
+# Callback to start, cancel and follow the background crime query.
+# crime_ready is set once the data is cached, which redraws the map and the table.
 @app.callback(
-    Output(component_id='crime_div', component_property='children'),
-    [Input(component_id='submit_button', component_property='n_clicks')],
+    [Output(component_id='crime_job', component_property='data'),
+     Output(component_id='job_interval', component_property='disabled'),
+     Output(component_id='job_status', component_property='children'),
+     Output(component_id='cancel_button', component_property='style'),
+     Output(component_id='crime_ready', component_property='data')],
+    [Input(component_id='submit_button', component_property='n_clicks'),
+     Input(component_id='cancel_button', component_property='n_clicks'),
+     Input(component_id='job_interval', component_property='n_intervals')],
     [State(component_id='police_force_dropdown', component_property='value'),
      State(component_id='police_neighbourhood', component_property='value'),
-     State(component_id='crime_date', component_property='value')])
+     State(component_id='crime_date', component_property='value'),
+     State(component_id='crime_date_end', component_property='value'),
+     State(component_id='crime_job', component_property='data')])
+
+def update_crime_job(n_clicks, cancel_clicks, n_intervals, police_force_dropdown, neighbourhood_dropdown, crime_date_dropdown, crime_date_end_dropdown, crime_job):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'submit_button.n_clicks' in triggered:
+        query = {'n_clicks':n_clicks, 'police_force':police_force_dropdown, 'neighbourhood':neighbourhood_dropdown,
+                 'crime_date':crime_date_dropdown, 'crime_date_end':crime_date_end_dropdown}
+        if police_force_dropdown is None or neighbourhood_dropdown is None or crime_date_dropdown is None:
+            return None, True, None, HIDDEN, query
+        months = month_range(crime_date_dropdown, crime_date_end_dropdown)
+        job_id = jobs.submit(fetch_crime_data, police_force_dropdown, neighbourhood_dropdown, months)
+        return dict(query, job_id=job_id), False, job_progress('Starting', 0), SHOWN, dash.no_update
+    if crime_job is None:
+        raise PreventUpdate
+    if 'cancel_button.n_clicks' in triggered:
+        jobs.cancel(crime_job['job_id'])
+        return None, True, html.H5('Query cancelled.'), HIDDEN, dash.no_update
+    status = jobs.status(crime_job['job_id'])
+    if status is None or status['status'] == 'cancelled':
+        return None, True, None, HIDDEN, dash.no_update
+    elif status['status'] == 'failed':
+        return None, True, html.H5(f'Could not fetch crimes: {status["message"]}'), HIDDEN, dash.no_update
+    elif status['status'] == 'done':
+        query = {k:v for k, v in crime_job.items() if k != 'job_id'}
+        return None, True, None, HIDDEN, query
+    return dash.no_update, False, job_progress(status['message'], status['progress']), SHOWN, dash.no_update
+
+def job_progress(message, progress):
+    return html.Div([
+        html.Progress(value=str(progress), max='1', style={'width':'40%'}),
+        html.Span(f' {message} ', style={'fontFamily':'nunito'})
+    ], style={'display':'inline-block'})
 
+# Callback to create crime table
+@app.callback(
+    Output(component_id='crime_div', component_property='children'),
+    [Input(component_id='crime_ready', component_property='data')])
 
-def update_crime_table(n_clicks, police_force_dropdown, neighbourhood_dropdown, crime_date_dropdown):
-    returned_data = generate_crime_table(n_clicks, police_force_dropdown, neighbourhood_dropdown, crime_date_dropdown)
+def update_crime_table(crime_ready):
+    if crime_ready is None:
+        return None
+    returned_data = generate_crime_table(crime_ready['n_clicks'], crime_ready['police_force'], crime_ready['neighbourhood'], crime_ready['crime_date'], crime_ready['crime_date_end'])
     return returned_data
 
-# Generating map each time input changes
+# Callback to serve one page of the crime table, sorted and filtered on the server
 @app.callback(
+    [Output(component_id='crime_table', component_property='data'),
+     Output(component_id='crime_table', component_property='page_count')],
+    [Input(component_id='crime_table', component_property='page_current'),
+     Input(component_id='crime_table', component_property='page_size'),
+     Input(component_id='crime_table', component_property='sort_by'),
+     Input(component_id='crime_table', component_property='filter_query')],
+    [State(component_id='crime_query', component_property='data')])
+
+def update_crime_table_page(page_current, page_size, sort_by, filter_query, crime_query):
+    df = get_crime_frame(crime_query['police_force'], crime_query['neighbourhood'], crime_query['months'])
+    if df is None:
+        return [], 1
+    return table_page(df, page_current, page_size, sort_by, filter_query)
+
+# Generating map each time input changes, and again when the zoom level changes the clustering
+@app.callback(
+    [Output(component_id='map_figure', component_property='data'),
+     Output(component_id='map_query', component_property='data')],
+    [Input(component_id='crime_ready', component_property='data'),
+     Input(component_id='crime_map', component_property='relayoutData')],
+    [State(component_id='map_query', component_property='data')])
+
+def update_map(crime_ready, relayout_data, map_query):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'crime_map.relayoutData' in triggered:
+        zoom = (relayout_data or {}).get('mapbox.zoom')
+        if map_query is None or zoom is None or int(zoom) == map_query['zoom']:
+            raise PreventUpdate
+        if map_query['police_force'] is None or map_query['neighbourhood'] is None or map_query['crime_date'] is None:
+            raise PreventUpdate # nothing is clustered without a complete query
+        map_query = dict(map_query, zoom=int(zoom))
+    else:
+        map_query = dict(crime_ready or {'n_clicks':None, 'police_force':None, 'neighbourhood':None,
+                                         'crime_date':None, 'crime_date_end':None}, zoom=MAP_ZOOM)
+    returned_map = generate_map(map_query['n_clicks'], map_query['police_force'], map_query['neighbourhood'],
+                                map_query['crime_date'], map_query['crime_date_end'], map_query['zoom'])
+    return returned_map, map_query
+
+# Category filter, category highlight and table selection are applied to the map in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='crime_map', function_name='style_figure'),
     Output(component_id='crime_map', component_property='figure'),
-    [Input(component_id='submit_button', component_property='n_clicks')],
-    [State(component_id='police_force_dropdown', component_property='value'),
-     State(component_id='police_neighbourhood', component_property='value'),
-     State(component_id='crime_date', component_property='value')])
+    [Input(component_id='map_figure', component_property='data'),
+     Input(component_id='category_filter', component_property='value'),
+     Input(component_id='category_highlight', component_property='value'),
+     Input(component_id='selected_crimes', component_property='data')])
+
+app.clientside_callback(
+    ClientsideFunction(namespace='crime_map', function_name='selected_crimes'),
+    Output(component_id='selected_crimes', component_property='data'),
+    [Input(component_id='crime_table', component_property='selected_rows'),
+     Input(component_id='crime_table', component_property='data')])
+
+# Callback to start and follow the national aggregation behind the overview map
+@app.callback(
+    [Output(component_id='aggregate_job', component_property='data'),
+     Output(component_id='aggregate_interval', component_property='disabled'),
+     Output(component_id='aggregate_status', component_property='children'),
+     Output(component_id='aggregate_ready', component_property='data')],
+    [Input(component_id='aggregate_button', component_property='n_clicks'),
+     Input(component_id='aggregate_interval', component_property='n_intervals')],
+    [State(component_id='overview_month', component_property='value'),
+     State(component_id='aggregate_job', component_property='data')])
+
+def update_aggregate_job(n_clicks, n_intervals, month, aggregate_job):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'aggregate_button.n_clicks' in triggered and month is not None:
+        job_id = start_aggregate_national(month)
+        return job_id, False, job_progress('Starting', 0), dash.no_update
+    if aggregate_job is None:
+        raise PreventUpdate
+    status = rollup_jobs.status(aggregate_job)
+    if status is None or status['status'] == 'cancelled':
+        return None, True, None, dash.no_update
+    elif status['status'] == 'failed':
+        return None, True, html.H5(f'Could not aggregate crimes: {status["message"]}'), dash.no_update
+    elif status['status'] == 'done':
+        return None, True, None, aggregate_job
+    return dash.no_update, False, job_progress(status['message'], status['progress']), dash.no_update
+
+# Overview map of the chosen month, national or for the selected police force
+@app.callback(
+    Output(component_id='overview_map', component_property='figure'),
+    [Input(component_id='overview_month', component_property='value'),
+     Input(component_id='police_force_dropdown', component_property='value'),
+     Input(component_id='aggregate_ready', component_property='data')])
 
-def update_map(n_clicks, police_force_dropdown, neighbourhood_dropdown, crime_date_dropdown):
-    returned_map = generate_map(n_clicks, police_force_dropdown, neighbourhood_dropdown, crime_date_dropdown)
-    return returned_map
+def update_overview(month, police_force, revision):
+    return generate_overview(month, police_force, revision)
+
+# Drill down from the overview, a force click selects the force and a neighbourhood click runs its query
+@app.callback(
+    [Output(component_id='police_force_dropdown', component_property='value'),
+     Output(component_id='police_neighbourhood', component_property='value'),
+     Output(component_id='crime_date', component_property='value'),
+     Output(component_id='crime_date_end', component_property='value'),
+     Output(component_id='submit_button', component_property='n_clicks')],
+    [Input(component_id='overview_map', component_property='clickData')],
+    [State(component_id='overview_month', component_property='value'),
+     State(component_id='police_force_dropdown', component_property='value'),
+     State(component_id='submit_button', component_property='n_clicks')])
+
+def drill_down(click_data, month, police_force, n_clicks):
+    if click_data is None:
+        raise PreventUpdate
+    police_id, neighbourhood_id = click_data['points'][0]['customdata']
+    police_name = {f['id']:f['name'] for f in reference.forces}.get(police_id)
+    if police_name is None:
+        raise PreventUpdate
+    if police_name != police_force:
+        return police_name, None, dash.no_update, dash.no_update, dash.no_update
+    neighbourhood_name = {n['id']:n['name'] for n in catalogue.neighbourhoods(police_id)}.get(neighbourhood_id)
+    return dash.no_update, neighbourhood_name, month, None, (n_clicks or 0) + 1
 
 # Update the social media and website link
 @app.callback(
@@ -465,8 +1221,7 @@ def update_map(n_clicks, police_force_dropdown, neighbourhood_dropdown, crime_da
 def update_media_links(input_police_force):
     if input_police_force is not None:
         police_id = get_police_force_id(input_police_force)
-        force = police.get_force(police_id)
-        media = force.engagement_methods
+        media = catalogue.engagement_methods(police_id)
         data = [
             html.Div(
                 html.A(f'{m["title"].title()}', href=f'{m["url"]}', target='_blank'),
@@ -477,6 +1232,34 @@ def update_media_links(input_police_force):
         return None
 
 
+# Metrics for every callback registered above
+metrics.instrument_callbacks(app)
+metrics.init_app(server)
+
+
+# Background threads run only in processes serving pages, so scripts importing
+# this module, such as warm_cache.py and its worker processes, start none of them
+background_lock = threading.Lock()
+background_started = False
+
+def start_background():
+    """Starts the reference refresh, new month rollups, catalogue prefetch and metrics dump once per process."""
+    global background_started
+    with background_lock:
+        if background_started:
+            return
+        reference.new_month_callbacks.append(start_rollup_new_months)
+        reference.start()
+        catalogue.start_prefetch()
+        metrics.start_dump()
+        background_started = True
+
+@server.before_request
+def start_background_on_request():
+    if not background_started:
+        start_background()
+
+
 # Running the app
 if __name__ == "__main__":
     app.run_server()
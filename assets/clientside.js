@@ -0,0 +1,49 @@
+// Clientside callbacks for the crime map.
+// These run in the browser, so filtering and highlighting crime categories or
+// showing the selected table rows needs no request to the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    crime_map: {
+        // Map figure from the stored traces with the category filter, highlight and table selection applied
+        style_figure: function(map_figure, visible_categories, highlight, selected) {
+            if (!map_figure || !map_figure.data) {
+                return window.dash_clientside.no_update;
+            }
+            var visible = visible_categories || [];
+            var hasCategories = false;
+            var data = map_figure.data.map(function(trace) {
+                if (trace.meta !== 'crime_category') {
+                    return trace;
+                }
+                hasCategories = true;
+                var dimmed = highlight && trace.name !== highlight;
+                return Object.assign({}, trace, {
+                    visible: visible.indexOf(trace.name) >= 0 ? true : 'legendonly',
+                    marker: Object.assign({}, trace.marker, {opacity: dimmed ? 0.15 : 1})
+                });
+            });
+            if (hasCategories && selected && selected.length > 0) {
+                data.push({
+                    type: 'scattermapbox',
+                    lat: selected.map(function(s) { return s.lat; }),
+                    lon: selected.map(function(s) { return s.lon; }),
+                    text: selected.map(function(s) { return s.text; }),
+                    mode: 'markers',
+                    marker: {size: 16, color: 'white', opacity: 0.8},
+                    name: 'Selected crimes',
+                    hoverinfo: 'text'
+                });
+            }
+            return Object.assign({}, map_figure, {data: data});
+        },
+
+        // Locations of the selected rows on the current page of the crime table
+        selected_crimes: function(selected_rows, rows) {
+            if (!selected_rows || !rows) {
+                return [];
+            }
+            return selected_rows.filter(function(i) { return i < rows.length; }).map(function(i) {
+                return {lat: rows[i]['Latitude'], lon: rows[i]['Longitude'], text: rows[i]['Location Name']};
+            });
+        }
+    }
+});
@@ -0,0 +1,177 @@
+# Benchmarks of the callback hot paths, replayed offline.
+# Measures wall time, peak memory and serialised payload size of generate_map,
+# generate_crime_table, create_data_dict, calculate_crime_summary and
+# populate_police_neighbourhood for recorded neighbourhoods, synthetic quiet to
+# dense profiles and synthetic scaling up to 100k crimes.
+#
+# Usage:
+#   python benchmarks/bench_callbacks.py [--output results.json] [--compare baseline.json]
+#   python benchmarks/bench_callbacks.py --record NAME FORCE_NAME NEIGHBOURHOOD_NAME MONTH [MONTH ...]
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The app must use a throwaway cache and an unthrottled client before it is imported.
+os.environ['CRIME_CACHE_DIR'] = tempfile.mkdtemp(prefix='crime_bench_')
+os.environ.setdefault('POLICE_API_RATE', '1000000')
+os.environ.setdefault('POLICE_API_BURST', '1000000')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import plotly
+
+from replay import record, replay, synthetic_recording
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings')
+MONTHS = ['2020-01', '2020-02', '2020-03']
+PROFILES = {'rural':30, 'suburban':300, 'city_centre':3000} # crimes per month
+SCALING = [1000, 10000, 100000] # crimes in one month
+REPEATS = 5
+
+mock = replay(synthetic_recording(1, MONTHS)) # answers any request made while importing the app
+import app
+
+
+def unwrap(callback):
+    """Dash callbacks are wrapped, the benchmarks call the underlying function."""
+    return getattr(callback, '__wrapped__', callback)
+
+
+def payload_size(result):
+    return len(json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def reset_memo():
+    app.cache.clear()
+
+
+def reset_all():
+    """Forget everything fetched so the next call replays the upstream requests."""
+    reset_memo()
+    with app.crime_cache._connect() as conn:
+        conn.execute('DELETE FROM entries')
+    for memory in [app.catalogue._neighbourhoods, app.catalogue._neighbourhood_ids, app.catalogue._boundaries,
+                   app.catalogue._centres, app.catalogue._engagement_methods]:
+        memory.clear()
+    with app.rollups._connect() as conn:
+        conn.execute('DELETE FROM rollups')
+        conn.execute('DELETE FROM rollup_months')
+        conn.execute('DELETE FROM tracked')
+
+
+def measure(fn, reset, repeats=REPEATS):
+    """Returns the result, median wall time and peak traced memory of fn()."""
+    times = []
+    for _ in range(repeats):
+        reset()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    reset()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, statistics.median(times), peak
+
+
+def run_case(case, recording, results, include_cold=True):
+    global mock
+    mock.stop()
+    mock = replay(recording)
+    meta = recording['_meta']
+    force, neighbourhood, months = meta['force'], meta['neighbourhood'], meta['months']
+    reset_all()
+    app.reference.refresh()
+
+    police_id = app.get_police_force_id(force)
+    neighbourhood_id = app.get_neighbourhood_id(force, neighbourhood)
+    boundary = app.catalogue.boundary(police_id, neighbourhood_id)
+    crimes = [c for m in months for c in app.police.get_crimes_area(boundary, date=m)]
+
+    def add(benchmark, mode, fn, reset):
+        result, wall_time, peak = measure(fn, reset)
+        results.append({
+            'benchmark':benchmark, 'case':case, 'mode':mode, 'crimes':len(crimes),
+            'wall_time_s':round(wall_time, 6), 'peak_memory_bytes':peak, 'payload_bytes':payload_size(result)})
+        print(f'{case:>14} {benchmark:>30} {mode:>5} {wall_time * 1000:10.2f} ms {peak / 1e6:8.2f} MB', file=sys.stderr)
+
+    add('create_data_dict', 'warm', lambda: app.create_data_dict(app.COLUMN_HEADING, crimes), reset_memo)
+    query = (1, force, neighbourhood, months[0], months[-1])
+    app.get_crime_frame(force, neighbourhood, months)
+    add('calculate_crime_summary', 'warm', lambda: app.calculate_crime_summary.uncached(force, neighbourhood, months), lambda: None)
+    for mode, reset in [('cold', reset_all), ('warm', reset_memo)] if include_cold else [('warm', reset_memo)]:
+        if mode == 'warm':
+            app.generate_crime_table(*query) # fill the caches once
+        add('generate_map', mode, lambda: app.generate_map(*query), reset)
+        add('generate_crime_table', mode, lambda: app.generate_crime_table(*query), reset)
+        add('populate_police_neighbourhood', mode, lambda: unwrap(app.populate_police_neighbourhood)(force), reset)
+
+
+def compare(results, baseline_path, threshold):
+    """Returns the results more than threshold times slower than the baseline."""
+    with open(baseline_path) as f:
+        baseline = {(r['benchmark'], r['case'], r['mode']):r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        before = baseline.get((r['benchmark'], r['case'], r['mode']))
+        if before is not None and r['wall_time_s'] > before['wall_time_s'] * threshold:
+            regressions.append(dict(r, baseline_wall_time_s=before['wall_time_s']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the crime dashboard callbacks against replayed police api responses.')
+    parser.add_argument('--output', help='write the json results here instead of stdout')
+    parser.add_argument('--compare', help='baseline json results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown over the baseline counted as a regression (default 1.25)')
+    parser.add_argument('--record', nargs='+', metavar='ARG', help='NAME FORCE_NAME NEIGHBOURHOOD_NAME MONTH [MONTH ...], record live responses')
+    args = parser.parse_args()
+
+    if args.record:
+        if len(args.record) < 4:
+            parser.error('--record needs NAME FORCE_NAME NEIGHBOURHOOD_NAME and at least one MONTH')
+        mock.stop()
+        name, force, neighbourhood, months = args.record[0], args.record[1], args.record[2], sorted(args.record[3:])
+        os.makedirs(RECORDINGS_DIR, exist_ok=True)
+        save = record(app.police, os.path.join(RECORDINGS_DIR, f'{name}.json'),
+                      {'force':force, 'neighbourhood':neighbourhood, 'months':months})
+        app.reference.refresh()
+        with app.server.test_request_context():
+            app.generate_crime_table(1, force, neighbourhood, months[0], months[-1])
+            unwrap(app.populate_police_neighbourhood)(force)
+        save()
+        return
+
+    results = []
+    with app.server.test_request_context():
+        for path in sorted(glob.glob(os.path.join(RECORDINGS_DIR, '*.json'))):
+            with open(path) as f:
+                run_case(os.path.splitext(os.path.basename(path))[0], json.load(f), results)
+        for case, crimes_per_month in PROFILES.items():
+            run_case(case, synthetic_recording(crimes_per_month, MONTHS), results)
+        for crimes in SCALING:
+            run_case(f'scale_{crimes}', synthetic_recording(crimes, MONTHS[:1]), results, include_cold=False)
+
+    output = {'python':sys.version.split()[0], 'repeats':REPEATS, 'results':results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for r in regressions:
+            print(f'Regression: {r["benchmark"]} {r["case"]} {r["mode"]} {r["baseline_wall_time_s"]}s -> {r["wall_time_s"]}s', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# Recording and offline replay of police api responses for the benchmarks.
+# A recording is a json dict of 'VERB path?params' keys and response bodies.
+# Crime queries are keyed on their month only, so split or simplified
+# boundaries replay the same crimes.
+import json
+import random
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import responses
+
+from police_transport import POLICE_API_URL
+
+CATEGORIES = [
+    ('anti-social-behaviour', 'Anti-social behaviour'),
+    ('bicycle-theft', 'Bicycle theft'),
+    ('burglary', 'Burglary'),
+    ('criminal-damage-arson', 'Criminal damage and arson'),
+    ('drugs', 'Drugs'),
+    ('other-theft', 'Other theft'),
+    ('possession-of-weapons', 'Possession of weapons'),
+    ('public-order', 'Public order'),
+    ('robbery', 'Robbery'),
+    ('shoplifting', 'Shoplifting'),
+    ('theft-from-the-person', 'Theft from the person'),
+    ('vehicle-crime', 'Vehicle crime'),
+    ('violent-crime', 'Violence and sexual offences'),
+    ('other-crime', 'Other crime')]
+
+
+def request_key(verb, url, params):
+    """Key of a request in a recording, ignoring the boundary polygon."""
+    path = urlsplit(url).path[len(urlsplit(POLICE_API_URL).path):]
+    params = sorted((k, v) for k, v in dict(params or {}).items() if k != 'poly' and v is not None)
+    return f'{verb} {path}?{urlencode(params)}'
+
+
+def record(police, path, meta):
+    """
+    Wraps the police client so every response is saved to a recording at path.
+    meta names the force, neighbourhood and months the recording is for.
+    Returns a function that writes the recording.
+    """
+    recording = {'_meta':meta}
+    make_request = police.service._make_request
+
+    def recording_request(verb, url, params={}):
+        body = make_request(verb, url, params)
+        recording[request_key(verb, url, params)] = body
+        return body
+
+    police.service._make_request = recording_request
+
+    def save():
+        # compact and sorted, so recordings stay small and diff cleanly when committed
+        with open(path, 'w') as f:
+            json.dump(recording, f, separators=(',', ':'), sort_keys=True)
+            f.write('\n')
+    return save
+
+
+def replay(recording):
+    """Returns a started responses mock answering police api requests from the recording."""
+    def callback(request):
+        parts = urlsplit(request.url)
+        params = dict(parse_qsl(parts.query))
+        if request.body:
+            body = request.body if isinstance(request.body, str) else request.body.decode('utf-8')
+            params.update(parse_qsl(body))
+        key = request_key(request.method, f'{parts.scheme}://{parts.netloc}{parts.path}', params)
+        if key not in recording:
+            return 404, {}, json.dumps({'error':f'not recorded: {key}'})
+        return 200, {'Content-Type':'application/json'}, json.dumps(recording[key])
+
+    mock = responses.RequestsMock(assert_all_requests_are_fired=False)
+    url = re.compile(re.escape(POLICE_API_URL) + '.*')
+    mock.add_callback(responses.GET, url, callback=callback)
+    mock.add_callback(responses.POST, url, callback=callback)
+    mock.start()
+    return mock
+
+
+def synthetic_recording(crimes_per_month, months, force=('synthetic', 'Synthetic Police'),
+                        neighbourhood=('N1', 'Synthetic Neighbourhood'), seed=0):
+    """
+    A recording of one force and neighbourhood with crimes_per_month crimes in
+    each month. About four crimes share each anonymised snap point, as in real data.
+    """
+    rnd = random.Random(seed)
+    lat, lon, size = 51.5, -0.1, 0.02
+    boundary = [(lat, lon), (lat + size, lon), (lat + size, lon + size), (lat, lon + size)]
+    snap_points = [(round(lat + rnd.random() * size, 6), round(lon + rnd.random() * size, 6), i)
+                   for i in range(max(1, crimes_per_month // 4))]
+    recording = {
+        '_meta':{'force':force[1], 'neighbourhood':neighbourhood[1], 'months':sorted(months)},
+        request_key('GET', POLICE_API_URL + 'crimes-street-dates', {}):[{'date':m, 'stop-and-search':[]} for m in months],
+        request_key('GET', POLICE_API_URL + 'forces', {}):[{'id':force[0], 'name':force[1]}],
+        request_key('GET', POLICE_API_URL + f'{force[0]}/neighbourhoods', {}):[{'id':neighbourhood[0], 'name':neighbourhood[1]}],
+        request_key('GET', POLICE_API_URL + f'forces/{force[0]}', {}):{'id':force[0], 'name':force[1], 'engagement_methods':[
+            {'title':'website', 'url':'https://www.police.uk', 'description':None}]},
+        request_key('GET', POLICE_API_URL + f'{force[0]}/{neighbourhood[0]}', {}):{
+            'id':neighbourhood[0], 'name':neighbourhood[1], 'centre':{'latitude':str(lat + size / 2), 'longitude':str(lon + size / 2)}},
+        request_key('GET', POLICE_API_URL + f'{force[0]}/{neighbourhood[0]}/boundary', {}):[
+            {'latitude':str(p[0]), 'longitude':str(p[1])} for p in boundary]}
+    crime_id = 0
+    for month in months:
+        recording[request_key('GET', POLICE_API_URL + 'crime-categories', {'date':month})] = (
+            [{'url':'all-crime', 'name':'All crime'}] + [{'url':u, 'name':n} for u, n in CATEGORIES])
+        crimes = []
+        for _ in range(crimes_per_month):
+            crime_id += 1
+            point = rnd.choice(snap_points)
+            crimes.append({
+                'category':rnd.choice(CATEGORIES)[0], 'location_type':'Force', 'context':'', 'persistent_id':'',
+                'id':crime_id, 'location_subtype':'', 'month':month, 'outcome_status':None,
+                'location':{'latitude':str(point[0]), 'longitude':str(point[1]),
+                            'street':{'id':point[2], 'name':f'On or near Street {point[2]}'}}})
+        recording[request_key('POST', POLICE_API_URL + 'crimes-street/all-crime', {'date':month})] = crimes
+    return recording
@@ -0,0 +1,127 @@
+# Shared crime result store.
+# Results are kept in a SQLite file on local disk so every gunicorn worker on
+# the dyno reads the same entries, unlike the per-process flask "simple" cache.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows, fall back to merging within the process only
+    fcntl = None
+
+CACHE_DIR = os.environ.get('CRIME_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+CACHE_MAX_BYTES = int(os.environ.get('CRIME_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+LOCK_STRIPES = 64 # keys share this many locks, so lock files do not grow with the keys
+
+_MISSING = object()
+
+
+class CrimeCache(object):
+    """
+    Size bounded key/value store shared between processes.
+    Entries expire after their own ttl and the least recently read entries are
+    evicted once the stored values add up to more than max_bytes.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, on_lookup=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # on_lookup(key, hit) is called once for every get_or_fetch
+        self.on_lookup = on_lookup
+        self.lock_dir = os.path.join(cache_dir, 'locks')
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'crimes.sqlite')
+        self._local = threading.local()
+        self._stripe_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'expires REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL DEFAULT 0)')
+            if 'size' not in [r[1] for r in conn.execute('PRAGMA table_info(entries)')]:
+                # stores written before entries were sized
+                conn.execute('ALTER TABLE entries ADD COLUMN size INTEGER NOT NULL DEFAULT 0')
+                conn.execute('UPDATE entries SET size = length(value)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def _connect(self):
+        """One connection per thread, sqlite connections can not be shared."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < now:
+            return default
+        with conn:
+            conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        value = json.dumps(value)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, value, expires, accessed, size) VALUES (?, ?, ?, ?, ?)',
+                (key, value, now + ttl, now, len(value)))
+            conn.execute('DELETE FROM entries WHERE expires < ?', (now,))
+            # keep the most recently read entries that fit in max_bytes
+            conn.execute(
+                'DELETE FROM entries WHERE key IN ('
+                'SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS total FROM entries) '
+                'WHERE total > ?)',
+                (self.max_bytes,))
+
+    def _stripe(self, key):
+        return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % LOCK_STRIPES
+
+    def get_or_fetch(self, key, fetch, ttl):
+        """
+        Return the cached value for key, calling fetch() on a miss.
+        Concurrent misses for the same key, from threads or other workers,
+        wait for the first fetch instead of repeating the upstream call.
+        Keys sharing a lock stripe also wait for each other while one is fetched,
+        so a get_or_fetch made inside fetch() takes no lock, which avoids deadlocks.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            if self.on_lookup is not None:
+                self.on_lookup(key, True)
+            return value
+        if getattr(self._local, 'fetching', False):
+            return self._fetch(key, fetch, ttl)
+        stripe = self._stripe(key)
+        with self._stripe_locks[stripe]:
+            lock_file = None
+            if fcntl is not None:
+                lock_file = open(os.path.join(self.lock_dir, f'{stripe}.lock'), 'w')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._local.fetching = True
+            try:
+                return self._fetch(key, fetch, ttl)
+            finally:
+                self._local.fetching = False
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+
+    def _fetch(self, key, fetch, ttl):
+        value = self.get(key, _MISSING)
+        hit = value is not _MISSING
+        if not hit:
+            value = fetch()
+            self.set(key, value, ttl)
+        if self.on_lookup is not None:
+            self.on_lookup(key, hit)
+        return value
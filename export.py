@@ -0,0 +1,90 @@
+# Streaming crime data export.
+# Crime tables are turned into CSV or Parquet one month at a time by a chain of
+# generators, so a download of any length only holds one month in memory.
+import csv
+import io
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+
+CSV_CHUNK_ROWS = 1000 # rows written per CSV chunk
+EXPORT_FORMATS = {'csv':'text/csv', 'parquet':'application/vnd.apache.parquet'}
+
+
+def parquet_available():
+    return pa is not None
+
+
+def csv_chunks(column_heading_list, tables):
+    """Yields CSV text, the header then CSV_CHUNK_ROWS rows at a time from each columnar table."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(column_heading_list)
+    for table in tables:
+        if table is None:
+            continue
+        rows = zip(*[table[h] for h in column_heading_list])
+        for i, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if i % CSV_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write only file collecting the bytes written since the last drain()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(column_heading_list, tables):
+    """Yields a Parquet file in pieces, one row group per columnar table."""
+    schema = pa.schema([
+        (h, pa.float64() if h in ['Latitude', 'Longitude'] else pa.string()) for h in column_heading_list])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for table in tables:
+            if table is None:
+                continue
+            writer.write_table(pa.table({h:table[h] for h in column_heading_list}, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain() # the footer
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip compresses a stream of bytes or text chunks."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,115 @@
+# Polygon helpers for neighbourhood boundaries.
+# Boundaries are lists of (latitude, longitude) points as returned by the police api.
+import numpy as np
+
+
+def bounding_box(boundary):
+    """Returns (min_lat, min_lon, max_lat, max_lon) of the boundary."""
+    points = np.asarray(boundary, dtype=float)
+    return float(points[:, 0].min()), float(points[:, 1].min()), float(points[:, 0].max()), float(points[:, 1].max())
+
+
+def polygon_area(boundary):
+    """Shoelace area of the boundary in square degrees."""
+    points = np.asarray(boundary, dtype=float)
+    lats, lons = points[:, 0], points[:, 1]
+    return abs(np.dot(lats, np.roll(lons, -1)) - np.dot(lons, np.roll(lats, -1))) / 2
+
+
+def points_in_polygon(lats, lons, boundary):
+    """
+    Ray casting test of many points against one polygon.
+    Returns a boolean numpy array, True where the point is inside the boundary.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    points = np.asarray(boundary, dtype=float)
+    inside = np.zeros(lats.shape, dtype=bool)
+    y1, x1 = points[:, 0], points[:, 1]
+    y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+    for ya, xa, yb, xb in zip(y1, x1, y2, x2):
+        crosses = (ya > lats) != (yb > lats)
+        if ya != yb:
+            x_cross = xa + (lats - ya) * (xb - xa) / (yb - ya)
+            inside ^= crosses & (lons < x_cross)
+    return inside
+
+
+def _clip_edge(points, inside, intersect):
+    clipped = []
+    for i, current in enumerate(points):
+        previous = points[i - 1]
+        if inside(current):
+            if not inside(previous):
+                clipped.append(intersect(previous, current))
+            clipped.append(current)
+        elif inside(previous):
+            clipped.append(intersect(previous, current))
+    return clipped
+
+
+def clip_polygon(boundary, min_lat, min_lon, max_lat, max_lon):
+    """Sutherland-Hodgman clip of the boundary to a latitude/longitude rectangle."""
+    def at_lat(lat):
+        return lambda p, q: (lat, p[1] + (q[1] - p[1]) * (lat - p[0]) / (q[0] - p[0]))
+
+    def at_lon(lon):
+        return lambda p, q: (p[0] + (q[0] - p[0]) * (lon - p[1]) / (q[1] - p[1]), lon)
+
+    points = [tuple(p) for p in boundary]
+    for inside, intersect in [
+            (lambda p: p[0] >= min_lat, at_lat(min_lat)),
+            (lambda p: p[0] <= max_lat, at_lat(max_lat)),
+            (lambda p: p[1] >= min_lon, at_lon(min_lon)),
+            (lambda p: p[1] <= max_lon, at_lon(max_lon))]:
+        if points == []:
+            break
+        points = _clip_edge(points, inside, intersect)
+    return points
+
+
+def split_polygon(boundary, overlap=1e-5):
+    """
+    Split the boundary into up to four pieces along its bounding box quarters.
+    The quarters overlap slightly so points on a dividing line are not lost,
+    callers should de-duplicate what they find in the pieces.
+    """
+    min_lat, min_lon, max_lat, max_lon = bounding_box(boundary)
+    mid_lat, mid_lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    pieces = []
+    for lat_range in [(min_lat, mid_lat + overlap), (mid_lat - overlap, max_lat)]:
+        for lon_range in [(min_lon, mid_lon + overlap), (mid_lon - overlap, max_lon)]:
+            piece = clip_polygon(boundary, lat_range[0], lon_range[0], lat_range[1], lon_range[1])
+            if len(piece) >= 3 and polygon_area(piece) > 0:
+                pieces.append(piece)
+    return pieces
+
+
+def simplify_polygon(boundary, tolerance):
+    """
+    Douglas-Peucker simplification of the boundary.
+    Points closer than tolerance (in degrees) to the simplified outline are dropped.
+    """
+    points = np.asarray(boundary, dtype=float)
+    if len(points) < 4 or tolerance <= 0:
+        return [tuple(p) for p in points.tolist()]
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        furthest = int(distances.argmax())
+        if distances[furthest] > tolerance:
+            index = start + 1 + furthest
+            keep[index] = True
+            stack.extend([(start, index), (index, end)])
+    return [tuple(p) for p in points[keep].tolist()]
@@ -0,0 +1,144 @@
+# Background jobs for slow crime queries.
+# Jobs run on a thread pool in the worker that received them, while their
+# status, progress and cancellation flag live in a SQLite file on local disk, so
+# any gunicorn worker can answer the browser's progress polls or a cancel.
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from crime_cache import CACHE_DIR
+
+JOB_PATH = os.path.join(CACHE_DIR, 'jobs.sqlite')
+JOB_MAX_AGE = 24 * 60 * 60 # finished jobs are removed after a day
+# A running job not updated for this long is assumed lost with the worker that ran it
+JOB_STALE_TIMEOUT = int(os.environ.get('JOB_STALE_TIMEOUT', 5 * 60))
+JOB_HEARTBEAT_INTERVAL = 30 # running jobs touch their row this often, well inside the stale timeout
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when the user has cancelled it."""
+
+
+class Job(object):
+    """Handle passed to a running job to report progress."""
+
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.id = job_id
+
+    def progress(self, fraction, message):
+        """Record progress between 0 and 1, raises JobCancelled if the job was cancelled."""
+        if self.runner.update(self.id, progress=fraction, message=message):
+            raise JobCancelled()
+
+
+class JobRunner(object):
+    """
+    Runs functions of the form fn(job, *args) in the background.
+    submit() returns a job id straight away, status() and cancel() work from any process.
+    """
+
+    def __init__(self, path=JOB_PATH, max_workers=4):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, progress REAL NOT NULL, '
+                'message TEXT, cancelled INTEGER NOT NULL, updated REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def submit(self, fn, *args):
+        job_id = self.create()
+        self.start(job_id, fn, *args)
+        return job_id
+
+    def create(self):
+        """Records a queued job and returns its id, start() then runs it."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE updated < ?', (now - JOB_MAX_AGE,))
+            conn.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?)', (job_id, 'queued', 0, 'Queued', 0, now))
+        return job_id
+
+    def start(self, job_id, fn, *args):
+        self.executor.submit(self._run, job_id, fn, args)
+
+    def _run(self, job_id, fn, args):
+        with self._connect() as conn:
+            # a job cancelled or given up on while queued is not started
+            started = conn.execute(
+                "UPDATE jobs SET status = 'running', updated = ? WHERE id = ? AND status = 'queued' AND cancelled = 0",
+                (time.time(), job_id)).rowcount
+            if not started:
+                conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', message = 'Cancelled' WHERE id = ? AND status = 'queued'",
+                    (job_id,))
+                return
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, stop), name=f'job-heartbeat-{job_id}', daemon=True).start()
+        job = Job(self, job_id)
+        try:
+            fn(job, *args)
+            self._finish(job_id, status='done', progress=1, message='Done')
+        except JobCancelled:
+            self._finish(job_id, status='cancelled', message='Cancelled')
+        except Exception as e:
+            self._finish(job_id, status='failed', message=str(e) or e.__class__.__name__)
+        finally:
+            stop.set()
+
+    def _heartbeat(self, job_id, stop):
+        """Keeps a running job from looking lost while it works between progress updates."""
+        while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+            self.update(job_id)
+
+    def _finish(self, job_id, **fields):
+        """Records how a running job ended, unless it was already marked failed as lost."""
+        fields['updated'] = time.time()
+        columns = ', '.join(f'{k} = ?' for k in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ? AND status = 'running'", list(fields.values()) + [job_id])
+
+    def update(self, job_id, **fields):
+        """Updates the job row, returns True if the job has been cancelled."""
+        fields['updated'] = time.time()
+        columns = ', '.join(f'{k} = ?' for k in fields)
+        conn = self._connect()
+        with conn:
+            conn.execute(f'UPDATE jobs SET {columns} WHERE id = ?', list(fields.values()) + [job_id])
+        row = conn.execute('SELECT cancelled FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row is not None and bool(row[0])
+
+    def status(self, job_id):
+        """
+        Dict of the job status, progress and message, or None for an unknown job.
+        A running job without updates or heartbeats for JOB_STALE_TIMEOUT is marked failed,
+        queued jobs are only waiting for a free thread.
+        """
+        row = self._connect().execute(
+            'SELECT status, progress, message, updated FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row[0] == 'running' and row[3] < time.time() - JOB_STALE_TIMEOUT:
+            message = 'stopped responding, please try again'
+            self.update(job_id, status='failed', message=message)
+            return {'status':'failed', 'progress':row[1], 'message':message}
+        return {'status':row[0], 'progress':row[1], 'message':row[2]}
+
+    def cancel(self, job_id):
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET cancelled = 1 WHERE id = ?', (job_id,))
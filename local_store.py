@@ -0,0 +1,110 @@
+# Offline crime store.
+# Street level crime archives from https://data.police.uk/data/ are loaded into
+# a local SQLite file so the app can answer queries without the police api.
+#
+# Usage: python local_store.py archive.zip [more archives or folders] [--store PATH]
+import argparse
+import csv
+import io
+import os
+import re
+import sqlite3
+import zipfile
+
+import numpy as np
+
+from crime_cache import CACHE_DIR
+from geometry import bounding_box, points_in_polygon
+
+STORE_PATH = os.environ.get('CRIME_STORE_PATH', os.path.join(CACHE_DIR, 'local_crimes.sqlite'))
+STREET_FILE = re.compile(r'(\d{4}-\d{2})-(.+)-street\.csv$')
+
+
+class LocalCrimeStore(object):
+    """
+    Street level crimes partitioned by month and force.
+    Re-ingesting a month and force replaces that partition.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS crimes ('
+                'month TEXT NOT NULL, force TEXT NOT NULL, crime_id TEXT, category TEXT NOT NULL, '
+                'location TEXT, latitude REAL NOT NULL, longitude REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS crimes_partition ON crimes (month, force)')
+            conn.execute('CREATE INDEX IF NOT EXISTS crimes_position ON crimes (month, latitude, longitude)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def ingest_csv(self, name, text_file):
+        """Load one YYYY-MM-force-street.csv file, returns the number of crimes stored."""
+        match = STREET_FILE.search(name)
+        if match is None:
+            return 0
+        month, force = match.groups()
+        rows = (
+            (month, force, r['Crime ID'] or None, r['Crime type'], r['Location'], float(r['Latitude']), float(r['Longitude']))
+            for r in csv.DictReader(text_file) if r['Latitude'] and r['Longitude'])
+        with self._connect() as conn:
+            conn.execute('DELETE FROM crimes WHERE month = ? AND force = ?', (month, force))
+            count = conn.executemany('INSERT INTO crimes VALUES (?, ?, ?, ?, ?, ?, ?)', rows).rowcount
+        return count
+
+    def ingest(self, path):
+        """Load a data.police.uk zip archive, a folder of csv files or a single csv file."""
+        count = 0
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for name in archive.namelist():
+                    if STREET_FILE.search(name):
+                        with archive.open(name) as f:
+                            count += self.ingest_csv(name, io.TextIOWrapper(f, encoding='utf-8'))
+        elif os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    count += self.ingest(os.path.join(root, name))
+        elif STREET_FILE.search(path):
+            with open(path, newline='', encoding='utf-8') as f:
+                count += self.ingest_csv(path, f)
+        return count
+
+    def months(self):
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute('SELECT DISTINCT month FROM crimes ORDER BY month DESC')]
+
+    def get_crimes_area(self, boundary, month, column_heading_list):
+        """
+        Crimes inside the boundary for one month, as columnar data in the same
+        shape as create_data_dict in app.py, or None when there are no crimes.
+        """
+        min_lat, min_lon, max_lat, max_lon = bounding_box(boundary)
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT month, category, location, latitude, longitude FROM crimes '
+                'WHERE month = ? AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?',
+                (month, min_lat, max_lat, min_lon, max_lon)).fetchall()
+        if rows == []:
+            return None
+        columns = list(zip(*rows))
+        inside = points_in_polygon(columns[3], columns[4], boundary)
+        if not inside.any():
+            return None
+        return {h:np.asarray(c, dtype=object)[inside].tolist() for h, c in zip(column_heading_list, columns)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load data.police.uk street level crime archives into the local crime store.')
+    parser.add_argument('paths', nargs='+', help='zip archives, folders or YYYY-MM-force-street.csv files')
+    parser.add_argument('--store', default=STORE_PATH, help=f'SQLite file to load into (default {STORE_PATH})')
+    args = parser.parse_args()
+    store = LocalCrimeStore(args.store)
+    for path in args.paths:
+        print(f'{path}: {store.ingest(path)} crimes loaded')
+
+
+if __name__ == '__main__':
+    main()
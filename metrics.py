@@ -0,0 +1,245 @@
+# Prometheus metrics for the dashboard.
+# Counters and histograms are kept per process and written to a small json file
+# every few seconds, so the /metrics route of any gunicorn worker can report
+# the totals of all workers on the dyno.
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, request
+
+from crime_cache import CACHE_DIR
+
+METRICS_DIR = os.path.join(CACHE_DIR, 'metrics')
+METRICS_DUMP_INTERVAL = 10
+# Set METRICS_TIMING_LOG=1 to log the time and size of every request
+TIMING_LOG = os.environ.get('METRICS_TIMING_LOG') == '1'
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SIZE_BUCKETS = [1e3, 1e4, 1e5, 1e6, 1e7]
+DESCRIPTIONS = {
+    'dash_callback_duration_seconds':('histogram', 'Time spent in each Dash callback.'),
+    'dash_callback_response_bytes':('histogram', 'Serialised size of each Dash callback response.'),
+    'dash_callback_errors_total':('counter', 'Dash callbacks which raised an exception.'),
+    'police_api_request_duration_seconds':('histogram', 'Time spent in police api requests, including retries.'),
+    'police_api_errors_total':('counter', 'Police api requests which failed, by status code.'),
+    'cache_requests_total':('counter', 'Cache lookups by cached function and result.'),
+    'cache_key_seconds_total':('counter', 'Time spent building cache keys, by cached function.')}
+POLICE_ENDPOINTS = {'crimes-street', 'crimes-street-dates', 'crime-categories', 'crimes-at-location',
+                    'crimes-no-location', 'outcomes-for-crime', 'locate-neighbourhood', 'forces'}
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics(object):
+    """Thread safe counters and histograms labelled by a dict of label values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name + json.dumps(sorted(labels.items()))
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[self._key(name, labels)] += value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            key = self._key(name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = {'buckets':buckets, 'counts':[0] * len(buckets), 'sum':0, 'count':0}
+            histogram = self.histograms[key]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps({'counters':self.counters, 'histograms':self.histograms}))
+
+
+def _merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for key, value in snapshot['counters'].items():
+            counters[key] += value
+        for key, h in snapshot['histograms'].items():
+            if key not in histograms:
+                histograms[key] = {'buckets':h['buckets'], 'counts':[0] * len(h['buckets']), 'sum':0, 'count':0}
+            merged = histograms[key]
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], h['counts'])]
+            merged['sum'] += h['sum']
+            merged['count'] += h['count']
+    return counters, histograms
+
+
+def _labels(key):
+    name, labels = key[:key.index('[')], json.loads(key[key.index('['):])
+    return name, labels
+
+
+def _format_labels(labels):
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+
+
+def render(snapshots):
+    """Prometheus text exposition of the merged snapshots."""
+    counters, histograms = _merge(snapshots)
+    lines = defaultdict(list)
+    for key, value in sorted(counters.items()):
+        name, labels = _labels(key)
+        lines[name].append(f'{name}{_format_labels(labels)} {value:g}')
+    for key, h in sorted(histograms.items()):
+        name, labels = _labels(key)
+        for bound, count in zip(h['buckets'], h['counts']):
+            lines[name].append(f'{name}_bucket{_format_labels(labels + [["le", f"{bound:g}"]])} {count}')
+        lines[name].append(f'{name}_bucket{_format_labels(labels + [["le", "+Inf"]])} {h["count"]}')
+        lines[name].append(f'{name}_sum{_format_labels(labels)} {h["sum"]:g}')
+        lines[name].append(f'{name}_count{_format_labels(labels)} {h["count"]}')
+    text = []
+    for name in sorted(lines):
+        metric_type, description = DESCRIPTIONS.get(name, ('untyped', name))
+        text += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}'] + lines[name]
+    return '\n'.join(text) + '\n'
+
+
+metrics = Metrics()
+
+
+def record_cache(function_name, hit):
+    metrics.inc('cache_requests_total', {'function':function_name, 'result':'hit' if hit else 'miss'})
+
+
+def endpoint_label(method):
+    """Police api path with the ids replaced, e.g. force/neighbourhood/boundary."""
+    parts = method.split('/')
+    if parts[0] == 'crimes-street':
+        return method
+    elif parts[0] == 'forces':
+        return '/'.join(['forces'] + ['force' for _ in parts[1:2]] + parts[2:])
+    elif parts[0] in POLICE_ENDPOINTS:
+        return parts[0]
+    return '/'.join(['force'] + [p if p == 'neighbourhoods' else 'neighbourhood' for p in parts[1:2]] + parts[2:])
+
+
+def instrument_police(police):
+    """Times every request the police client makes, whichever police.* method made it."""
+    service = police.service
+    request_method = service.request
+
+    @functools.wraps(request_method)
+    def timed_request(verb, method, **kwargs):
+        endpoint = endpoint_label(method)
+        start = time.perf_counter()
+        try:
+            return request_method(verb, method, **kwargs)
+        except Exception as e:
+            metrics.inc('police_api_errors_total', {'endpoint':endpoint, 'status':getattr(e, 'status_code', None) or e.__class__.__name__})
+            raise
+        finally:
+            metrics.observe('police_api_request_duration_seconds', {'endpoint':endpoint}, time.perf_counter() - start)
+
+    service.request = timed_request
+
+
+def instrument_callbacks(app):
+    """Times every registered Dash callback and records its response size."""
+    for output, spec in app.callback_map.items():
+        callback = spec.get('callback')
+        if callback is None: # clientside callbacks run in the browser
+            continue
+        name = getattr(getattr(callback, '__wrapped__', callback), '__name__', output)
+
+        def timed_callback(*args, _callback=callback, _name=name, **kwargs):
+            start = time.perf_counter()
+            try:
+                response = _callback(*args, **kwargs)
+            except Exception as e:
+                if e.__class__.__name__ != 'PreventUpdate':
+                    metrics.inc('dash_callback_errors_total', {'callback':_name})
+                raise
+            finally:
+                metrics.observe('dash_callback_duration_seconds', {'callback':_name}, time.perf_counter() - start)
+            if isinstance(response, (str, bytes)):
+                metrics.observe('dash_callback_response_bytes', {'callback':_name}, len(response), SIZE_BUCKETS)
+            return response
+
+        timed_callback.__wrapped__ = getattr(callback, '__wrapped__', callback)
+        spec['callback'] = timed_callback
+
+
+def _dump_loop():
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+    while True:
+        time.sleep(METRICS_DUMP_INTERVAL)
+        try:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(metrics.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception('Could not write metrics')
+
+
+def _worker_snapshots():
+    """This process's live metrics plus the last dump of every other live worker."""
+    snapshots = [metrics.snapshot()]
+    if not os.path.isdir(METRICS_DIR):
+        return snapshots
+    for name in os.listdir(METRICS_DIR):
+        match = re.match(r'(\d+)\.json$', name)
+        if match is None or int(match.group(1)) == os.getpid():
+            continue
+        path = os.path.join(METRICS_DIR, name)
+        try:
+            os.kill(int(match.group(1)), 0)
+        except ProcessLookupError:
+            os.remove(path) # worker has exited
+            continue
+        except PermissionError:
+            pass
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def start_dump():
+    """Start writing this worker's metrics for the other workers to read."""
+    threading.Thread(target=_dump_loop, name='metrics-dump', daemon=True).start()
+
+
+def init_app(server):
+    """Adds the /metrics route and the optional request timing log to the flask server."""
+
+    @server.route('/metrics')
+    def prometheus_metrics():
+        return Response(render(_worker_snapshots()), mimetype='text/plain; version=0.0.4')
+
+    if TIMING_LOG:
+        logging.basicConfig(level=logging.INFO)
+
+        @server.before_request
+        def start_timer():
+            g.request_start = time.perf_counter()
+
+        @server.after_request
+        def log_timing(response):
+            elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+            logger.info('%s %s %s %.1fms %sB', request.method, request.path, response.status_code,
+                        elapsed * 1000, response.calculate_content_length())
+            return response
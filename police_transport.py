@@ -0,0 +1,141 @@
+# Transport for the police api client.
+# Every police.* call goes through one pooled requests session, waits on a token
+# bucket sized to the api's request limit and retries 429 and 5xx responses.
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from police_api import BaseService, PoliceAPI
+
+from crime_cache import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows, the limit is then kept per process
+    fcntl = None
+
+# data.police.uk allows 15 requests a second with bursts of up to 30
+RATE_LIMIT = float(os.environ.get('POLICE_API_RATE', 15))
+RATE_BURST = float(os.environ.get('POLICE_API_BURST', 30))
+RATE_LIMIT_FILE = os.environ.get('POLICE_API_RATE_FILE', os.path.join(CACHE_DIR, 'rate_limit.json'))
+POLICE_API_URL = os.environ.get('POLICE_API_URL', 'https://data.police.uk/api/')
+RETRY_STATUS = {429, 500, 502, 504} # 503 means too many crimes in the area, see get_crimes_area
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10
+
+
+class TokenBucket(object):
+    """
+    Token bucket limiter for the threads of one process.
+    acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens, updated, now):
+        """Returns the new bucket state and how long to wait before retrying."""
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, now, 0
+        return tokens, now, (1 - tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self.tokens, self.updated, wait = self._take(self.tokens, self.updated, time.monotonic())
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+
+class FileTokenBucket(TokenBucket):
+    """
+    Token bucket shared by every process on the machine.
+    The bucket state lives in a small json file updated under an exclusive lock,
+    so all gunicorn workers together stay within the limit.
+    """
+
+    def __init__(self, path=RATE_LIMIT_FILE, rate=RATE_LIMIT, burst=RATE_BURST):
+        super(FileTokenBucket, self).__init__(rate, burst)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def acquire(self):
+        while True:
+            with self._lock, open(self.path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except ValueError:
+                    state = {'tokens':self.burst, 'updated':time.time()}
+                tokens, updated, wait = self._take(state['tokens'], state['updated'], time.time())
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({'tokens':tokens, 'updated':updated}))
+                fcntl.flock(f, fcntl.LOCK_UN)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+
+class ThrottledService(BaseService):
+    """
+    police_api service sending requests through a keep-alive connection pool,
+    a rate limiter and jittered exponential backoff.
+    """
+
+    def __init__(self, api, limiter=None, pool_size=20, **config):
+        config.setdefault('base_url', POLICE_API_URL)
+        super(ThrottledService, self).__init__(api, **config)
+        self.limiter = limiter or TokenBucket()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = self.config['user_agent']
+
+    def _backoff(self, attempt, response):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX) # never hold a callback thread for longer
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def _make_request(self, verb, url, params={}):
+        request_kwargs = {'timeout':self.config.get('timeout', 30)}
+        if 'username' in self.config:
+            request_kwargs['auth'] = (self.config.get('username', ''),
+                                      self.config.get('password', ''))
+        if verb == 'GET':
+            request_kwargs['params'] = params
+        else:
+            request_kwargs['data'] = params
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.acquire()
+            r = self.session.request(verb, url, **request_kwargs)
+            if r.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                break
+            time.sleep(self._backoff(attempt, r))
+        self.raise_for_status(r)
+        return r.json()
+
+
+def make_police_api(shared_limit=True, **config):
+    """
+    PoliceAPI using the throttled transport.
+    With shared_limit the rate limit is coordinated across processes through RATE_LIMIT_FILE.
+    """
+    police = PoliceAPI(**config)
+    limiter = FileTokenBucket() if shared_limit and fcntl is not None else TokenBucket()
+    police.service = ThrottledService(police, limiter=limiter, **config)
+    return police
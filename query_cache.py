@@ -0,0 +1,62 @@
+# Memoization keyed on the logical query.
+# Cached functions take the query itself, names or ids, months and view
+# parameters, never the data it produced. Keys are built from those small values
+# only, so building one is cheap and equal queries always share an entry.
+import functools
+import inspect
+import json
+import time
+
+import metrics
+
+MAX_KEY_STRING = 200 # longest string argument allowed in a key
+MAX_KEY_ITEMS = 120 # longest list argument allowed in a key, ten years of months
+
+_SCALARS = (type(None), bool, int, float, str)
+
+
+def _key_value(function_name, name, value):
+    """Returns value as a json friendly key part, raising TypeError for anything bulky."""
+    if isinstance(value, (list, tuple)) and len(value) <= MAX_KEY_ITEMS:
+        if all(isinstance(v, _SCALARS) and not (isinstance(v, str) and len(v) > MAX_KEY_STRING) for v in value):
+            return list(value)
+    elif isinstance(value, _SCALARS) and not (isinstance(value, str) and len(value) > MAX_KEY_STRING):
+        return value
+    raise TypeError(
+        f'{function_name} can not be cached on argument {name} of type {type(value).__name__}, '
+        'pass the query (names, ids, months) rather than the data')
+
+
+def cached_query(cache, timeout):
+    """
+    Decorator caching f in the flask cache for timeout seconds, keyed on its arguments.
+    Arguments must be small scalars or short lists of them, anything else raises
+    TypeError. Hits, misses and the time spent building keys are recorded in metrics.
+    """
+    def decorator(f):
+        signature = inspect.signature(f)
+        prefix = f'{f.__module__}.{f.__qualname__}'
+
+        def make_key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults() # f(1) and f(1, zoom=12) share an entry
+            parts = [_key_value(f.__name__, n, v) for n, v in bound.arguments.items()]
+            return prefix + json.dumps(parts, separators=(',', ':'))
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            key = make_key(args, kwargs)
+            metrics.metrics.inc('cache_key_seconds_total', {'function':f.__name__}, time.perf_counter() - start)
+            entry = cache.get(key) # values are wrapped in a list so a cached None is a hit
+            metrics.record_cache(f.__name__, entry is not None)
+            if entry is not None:
+                return entry[0]
+            value = f(*args, **kwargs)
+            cache.set(key, [value], timeout=timeout)
+            return value
+
+        wrapper.make_key = make_key
+        wrapper.uncached = f
+        return wrapper
+    return decorator
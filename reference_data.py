@@ -0,0 +1,212 @@
+# Reference data snapshot and force/neighbourhood catalogue.
+# The available crime months and the police force list are read from a local
+# json file so workers can serve straight away, and refreshed in the background.
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from crime_cache import CACHE_DIR
+
+SNAPSHOT_PATH = os.path.join(CACHE_DIR, 'reference_data.json')
+REFRESH_INTERVAL = int(os.environ.get('REFERENCE_REFRESH_INTERVAL', 6 * 60 * 60))
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceData(object):
+    """
+    Holds the latest snapshot of the crime dates and police forces.
+    A refresh writes a new file and swaps the whole snapshot in one assignment,
+    so readers never see a half updated list.
+    """
+
+    def __init__(self, police, path=SNAPSHOT_PATH, refresh_interval=REFRESH_INTERVAL):
+        self.police = police
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._snapshot = self._load() or {'updated':0, 'dates':[], 'forces':[]}
+        self._loaded = threading.Event()
+        if self.dates:
+            self._loaded.set()
+        self._thread = None
+        self.new_month_callbacks = []
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def dates(self):
+        """Months with crime data, newest first, in YYYY-MM format."""
+        return self._snapshot['dates']
+
+    @property
+    def forces(self):
+        """List of dicts with the police force id and name."""
+        return self._snapshot['forces']
+
+    @property
+    def updated(self):
+        return self._snapshot['updated']
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for a non empty snapshot, returns True once there is one."""
+        return self._loaded.wait(timeout)
+
+    def refresh(self):
+        """Fetch the reference data from the police api and swap it in."""
+        snapshot = {
+            'updated':time.time(),
+            'dates':self.police.get_dates(),
+            'forces':[{'id':p.id, 'name':p.name} for p in self.police.get_forces()]}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+        previous_dates = self.dates
+        self._snapshot = snapshot
+        if snapshot['dates']:
+            self._loaded.set()
+        new_months = [d for d in snapshot['dates'] if d not in previous_dates]
+        if previous_dates and new_months:
+            for callback in self.new_month_callbacks:
+                try:
+                    callback(new_months)
+                except Exception:
+                    logger.exception('New month callback failed')
+
+    def _refresh_loop(self):
+        while True:
+            # Another worker may already have written a newer snapshot.
+            on_disk = self._load()
+            if on_disk is not None and on_disk['updated'] > self.updated:
+                self._snapshot = on_disk
+                if on_disk['dates']:
+                    self._loaded.set()
+            if time.time() - self.updated >= self.refresh_interval:
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception('Reference data refresh failed')
+                    time.sleep(60)
+                    continue
+            time.sleep(min(self.refresh_interval, 300))
+
+    def start(self):
+        """Start the background refresh thread once per process."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name='reference-refresh', daemon=True)
+            self._thread.start()
+
+
+class Catalogue(object):
+    """
+    Indexed lookups for police forces and their neighbourhoods.
+    Names are resolved through dicts instead of scanning lists, and every
+    upstream lookup is fetched once, kept in memory and in the shared store,
+    both for ttl seconds.
+    """
+
+    def __init__(self, police, reference, store, ttl=REFRESH_INTERVAL * 4):
+        self.police = police
+        self.reference = reference
+        self.store = store
+        self.ttl = ttl
+        self._forces_source = None
+        self._force_ids = {}
+        self._neighbourhoods = {}
+        self._neighbourhood_ids = {}
+        self._boundaries = {}
+        self._centres = {}
+        self._engagement_methods = {}
+
+    def force_id(self, force_name):
+        """Return the police force id for a force name, or None."""
+        forces = self.reference.forces
+        if forces is not self._forces_source:
+            self._force_ids = {p['name']:p['id'] for p in forces}
+            self._forces_source = forces
+        return self._force_ids.get(force_name)
+
+    def _remembered(self, memory, key):
+        """The value kept in memory for key, or None once it has expired."""
+        entry = memory.get(key)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def _lookup(self, memory, key, fetch):
+        value = self._remembered(memory, key)
+        if value is None:
+            value = self.store.get_or_fetch(':'.join(key), fetch, self.ttl)
+            memory[key] = (value, time.time() + self.ttl)
+        return value
+
+    def neighbourhoods(self, force_id):
+        """List of dicts with the neighbourhood id and name, sorted by name."""
+        def fetch():
+            neighbourhoods = [{'id':n.id, 'name':n.name} for n in self.police.get_neighbourhoods(force_id)]
+            return sorted(neighbourhoods, key=lambda n: n['name'])
+        neighbourhoods = self._lookup(self._neighbourhoods, ('neighbourhoods', force_id), fetch)
+        source, ids = self._neighbourhood_ids.get(force_id, (None, None))
+        if neighbourhoods is not source: # rebuilt whenever the list is refreshed
+            ids = {n['name']:n['id'] for n in neighbourhoods}
+            self._neighbourhood_ids[force_id] = (neighbourhoods, ids)
+        return neighbourhoods
+
+    def neighbourhood_id(self, force_id, neighbourhood_name):
+        """Return the neighbourhood id for a neighbourhood name, or None."""
+        if force_id is None:
+            return None
+        self.neighbourhoods(force_id)
+        return self._neighbourhood_ids[force_id][1].get(neighbourhood_name)
+
+    def boundary(self, force_id, neighbourhood_id):
+        """List of (latitude, longitude) points around the neighbourhood."""
+        def fetch():
+            return self.police.get_neighbourhood(force_id, neighbourhood_id).boundary
+        return self._lookup(self._boundaries, ('boundary', force_id, neighbourhood_id), fetch)
+
+    def boundary_once(self, force_id, neighbourhood_id):
+        """
+        Boundary for one off uses such as the national aggregation. Taken from memory or
+        the shared store when already there, otherwise fetched without keeping it.
+        """
+        key = ('boundary', force_id, neighbourhood_id)
+        boundary = self._remembered(self._boundaries, key)
+        if boundary is None:
+            boundary = self.store.get(':'.join(key))
+        if boundary is None:
+            boundary = self.police.get_neighbourhood(force_id, neighbourhood_id).boundary
+        return boundary
+
+    def centre(self, force_id, neighbourhood_id):
+        """Dict with the lat and lon of the neighbourhood centre."""
+        def fetch():
+            centre = self.police.get_neighbourhood(force_id, neighbourhood_id).centre
+            return {'lon':float(centre['longitude']), 'lat':float(centre['latitude'])}
+        return self._lookup(self._centres, ('centre', force_id, neighbourhood_id), fetch)
+
+    def engagement_methods(self, force_id):
+        """List of dicts with the title and url of the force website and social media."""
+        def fetch():
+            return self.police.get_force(force_id).engagement_methods
+        return self._lookup(self._engagement_methods, ('engagement', force_id), fetch)
+
+    def prefetch(self, max_workers=8):
+        """Load the neighbourhoods of every force concurrently."""
+        while not self.reference.forces:
+            time.sleep(5) # first boot, wait for the snapshot refresh
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for force_id in [p['id'] for p in self.reference.forces]:
+                executor.submit(self.neighbourhoods, force_id)
+
+    def start_prefetch(self):
+        threading.Thread(target=self.prefetch, name='catalogue-prefetch', daemon=True).start()
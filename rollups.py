@@ -0,0 +1,146 @@
+# Materialised monthly crime counts.
+# Counts per neighbourhood, month and category are stored once so trend charts
+# and the national overview read a small aggregate table instead of re-fetching
+# raw crimes.
+import json
+import os
+import sqlite3
+import time
+
+from crime_cache import CACHE_DIR
+
+ROLLUP_PATH = os.path.join(CACHE_DIR, 'rollups.sqlite')
+
+
+class CrimeRollups(object):
+    """
+    Rollup table of crime counts per force, neighbourhood, month and category.
+    A month is recorded as aggregated even when it had no crimes, so it is
+    not fetched again until its expiry, published months never expire.
+    """
+
+    def __init__(self, path=ROLLUP_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rollup_months ('
+                'force TEXT NOT NULL, neighbourhood TEXT NOT NULL, month TEXT NOT NULL, expires REAL, '
+                'PRIMARY KEY (force, neighbourhood, month))')
+            if 'expires' not in [r[1] for r in conn.execute('PRAGMA table_info(rollup_months)')]:
+                conn.execute('ALTER TABLE rollup_months ADD COLUMN expires REAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rollups ('
+                'force TEXT NOT NULL, neighbourhood TEXT NOT NULL, month TEXT NOT NULL, '
+                'category TEXT NOT NULL, total INTEGER NOT NULL, '
+                'PRIMARY KEY (force, neighbourhood, month, category))')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tracked ('
+                'force TEXT NOT NULL, neighbourhood TEXT NOT NULL, PRIMARY KEY (force, neighbourhood))')
+            conn.execute('CREATE TABLE IF NOT EXISTS new_months (month TEXT PRIMARY KEY)')
+            conn.execute('CREATE TABLE IF NOT EXISTS job_claims (name TEXT PRIMARY KEY, job TEXT NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS shapes ('
+                'force TEXT NOT NULL, neighbourhood TEXT NOT NULL, boundary TEXT NOT NULL, '
+                'PRIMARY KEY (force, neighbourhood))')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def months(self, force_id, neighbourhood_id):
+        """Set of months aggregated for the neighbourhood and not expired."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT month FROM rollup_months WHERE force = ? AND neighbourhood = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (force_id, neighbourhood_id, time.time()))
+            return {r[0] for r in rows}
+
+    def add_month(self, force_id, neighbourhood_id, month, category_counts, ttl=None):
+        """
+        Store the counts of one month, a dict of crime category and total, replacing any
+        earlier counts. A month which may still be revised is given a ttl in seconds.
+        """
+        expires = time.time() + ttl if ttl is not None else None
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO rollup_months VALUES (?, ?, ?, ?)', (force_id, neighbourhood_id, month, expires))
+            conn.execute('DELETE FROM rollups WHERE force = ? AND neighbourhood = ? AND month = ?', (force_id, neighbourhood_id, month))
+            conn.executemany(
+                'INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?)',
+                [(force_id, neighbourhood_id, month, k, int(v)) for k, v in category_counts.items()])
+
+    def track(self, force_id, neighbourhood_id):
+        """Mark a neighbourhood whose trend has been viewed, so new months are added to it."""
+        with self._connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO tracked VALUES (?, ?)', (force_id, neighbourhood_id))
+
+    def tracked(self):
+        """List of (force id, neighbourhood id) pairs whose trend has been viewed."""
+        with self._connect() as conn:
+            return conn.execute('SELECT force, neighbourhood FROM tracked').fetchall()
+
+    def claim_months(self, months):
+        """True for the first caller only, so one worker rolls up newly published months."""
+        with self._connect() as conn:
+            return conn.executemany('INSERT OR IGNORE INTO new_months VALUES (?)', [(m,) for m in months]).rowcount > 0
+
+    def claim_job(self, name, job_id, running):
+        """
+        Records job_id as the job doing name, unless running(job) is true for the job
+        already recorded. Returns the job id doing the work, for the caller to follow.
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE') # other workers wait, so only one claim wins
+            row = conn.execute('SELECT job FROM job_claims WHERE name = ?', (name,)).fetchone()
+            if row is not None and running(row[0]):
+                return row[0]
+            conn.execute('INSERT OR REPLACE INTO job_claims VALUES (?, ?)', (name, job_id))
+            return job_id
+
+    def trend(self, force_id, neighbourhood_id, months):
+        """List of (month, category, total) rows for the given months, oldest first."""
+        placeholders = ', '.join('?' * len(months))
+        with self._connect() as conn:
+            return conn.execute(
+                'SELECT month, category, total FROM rollups '
+                f'WHERE force = ? AND neighbourhood = ? AND month IN ({placeholders}) ORDER BY month, category',
+                [force_id, neighbourhood_id] + list(months)).fetchall()
+
+    def aggregated(self, month):
+        """Set of (force id, neighbourhood id) pairs with the month aggregated and not expired."""
+        with self._connect() as conn:
+            return set(conn.execute(
+                'SELECT force, neighbourhood FROM rollup_months WHERE month = ? AND (expires IS NULL OR expires > ?)',
+                (month, time.time())))
+
+    def force_totals(self, month):
+        """List of (force, category, total) rows summed over the aggregated neighbourhoods of each force."""
+        with self._connect() as conn:
+            return conn.execute(
+                'SELECT force, category, SUM(total) FROM rollups WHERE month = ? '
+                'GROUP BY force, category ORDER BY force, SUM(total) DESC', (month,)).fetchall()
+
+    def neighbourhood_totals(self, month, force_id):
+        """List of (neighbourhood, total) rows for the aggregated neighbourhoods of a force, including those without crimes."""
+        with self._connect() as conn:
+            return conn.execute(
+                'SELECT m.neighbourhood, COALESCE(SUM(r.total), 0) FROM rollup_months m '
+                'LEFT JOIN rollups r ON r.force = m.force AND r.neighbourhood = m.neighbourhood AND r.month = m.month '
+                'WHERE m.month = ? AND m.force = ? GROUP BY m.neighbourhood', (month, force_id)).fetchall()
+
+    def add_shape(self, force_id, neighbourhood_id, boundary):
+        """Store the simplified boundary drawn on the overview map, a list of (latitude, longitude)."""
+        boundary = [[round(float(lat), 4), round(float(lon), 4)] for lat, lon in boundary]
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO shapes VALUES (?, ?, ?)',
+                         (force_id, neighbourhood_id, json.dumps(boundary, separators=(',', ':'))))
+
+    def shapes(self, force_id=None):
+        """Dict of (force id, neighbourhood id) to boundary, for one force or all of them."""
+        with self._connect() as conn:
+            if force_id is None:
+                rows = conn.execute('SELECT force, neighbourhood, boundary FROM shapes')
+            else:
+                rows = conn.execute('SELECT force, neighbourhood, boundary FROM shapes WHERE force = ?', (force_id,))
+            return {(r[0], r[1]):json.loads(r[2]) for r in rows}
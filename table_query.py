@@ -0,0 +1,88 @@
+# Server side paging, sorting and filtering for the crime DataTable.
+# Parses the filter_query and sort_by properties sent by a DataTable with
+# page_action, sort_action and filter_action set to 'custom'.
+import re
+
+import pandas as pd
+
+OPERATORS = [
+    ['ge ', '>='],
+    ['le ', '<='],
+    ['lt ', '<'],
+    ['gt ', '>'],
+    ['ne ', '!='],
+    ['eq ', '='],
+    ['contains '],
+    ['datestartswith ']]
+COLUMN_PATTERN = re.compile(r'^\{(.+?)\}\s*')
+
+
+def split_filter_part(filter_part):
+    """
+    Splits one '{column} operator value' part of a filter query.
+    Returns (column, operator, value) with value as the typed string, or
+    (None, None, None) if it can not be parsed.
+    """
+    filter_part = filter_part.strip()
+    match = COLUMN_PATTERN.match(filter_part)
+    if match is None:
+        return None, None, None
+    column = match.group(1)
+    rest = filter_part[match.end():]
+    for operator_type in OPERATORS:
+        for operator in operator_type:
+            if rest.startswith(operator):
+                value = rest[len(operator):].strip()
+                if value[:1] == value[-1:] and value[:1] in ['"', "'", '`'] and len(value) > 1:
+                    value = value[1:-1]
+                return column, operator_type[0].strip(), value
+    return None, None, None
+
+
+def filter_frame(df, filter_query):
+    """Returns the rows of df matching every part of the filter query."""
+    if not filter_query:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for filter_part in filter_query.split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in df.columns:
+            continue
+        series = df[column]
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            if pd.api.types.is_numeric_dtype(series):
+                try:
+                    value = float(value)
+                except ValueError:
+                    continue # text typed into a numeric column matches nothing sensible, ignore it
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.astype(str)
+            mask &= getattr(series, operator)(value)
+        elif operator == 'contains':
+            mask &= series.astype(str).str.contains(value, case=False, regex=False)
+        elif operator == 'datestartswith':
+            mask &= series.astype(str).str.startswith(value)
+    return df[mask]
+
+
+def sort_frame(df, sort_by):
+    """Sorts df by the DataTable sort_by list of {'column_id', 'direction'} dicts."""
+    sort_by = [s for s in sort_by or [] if s['column_id'] in df.columns]
+    if sort_by == []:
+        return df
+    return df.sort_values(
+        [s['column_id'] for s in sort_by],
+        ascending=[s['direction'] == 'asc' for s in sort_by],
+        kind='mergesort')
+
+
+def table_page(df, page_current, page_size, sort_by=None, filter_query=None):
+    """
+    Returns (records, page_count) for one page of the filtered and sorted frame.
+    Only the requested page is turned into records for the browser.
+    """
+    df = sort_frame(filter_frame(df, filter_query), sort_by)
+    page_current = page_current or 0
+    page_count = max(1, -(-len(df) // page_size))
+    page = df.iloc[page_current * page_size:(page_current + 1) * page_size]
+    return page.to_dict('records'), page_count
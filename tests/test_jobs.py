@@ -0,0 +1,86 @@
+import threading
+import time
+
+import jobs
+from jobs import JobRunner
+
+
+def wait_for(runner, job_id, statuses, timeout=5):
+    end = time.time() + timeout
+    while runner.status(job_id)['status'] not in statuses and time.time() < end:
+        time.sleep(0.01)
+    return runner.status(job_id)
+
+
+def test_job_reports_progress_and_finishes(tmp_path):
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite'))
+
+    def work(job, n):
+        job.progress(0.5, f'half of {n}')
+    job_id = runner.submit(work, 4)
+    assert wait_for(runner, job_id, ['done']) == {'status':'done', 'progress':1, 'message':'Done'}
+
+
+def test_cancelled_job_stops(tmp_path):
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite'))
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        while True:
+            job.progress(0, 'waiting')
+            time.sleep(0.01)
+    job_id = runner.submit(work)
+    started.wait(5)
+    runner.cancel(job_id)
+    assert wait_for(runner, job_id, ['cancelled'])['status'] == 'cancelled'
+
+
+def test_lost_job_is_marked_failed(tmp_path, monkeypatch):
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite'))
+    release = threading.Event()
+    job_id = runner.submit(lambda job: release.wait(5))
+    assert wait_for(runner, job_id, ['running'])['status'] == 'running'
+    # as if the worker running it had been killed
+    monkeypatch.setattr(jobs, 'JOB_STALE_TIMEOUT', -1)
+    assert runner.status(job_id)['status'] == 'failed'
+    release.set()
+
+
+def test_queued_job_is_not_stale(tmp_path, monkeypatch):
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite'), max_workers=1)
+    release = threading.Event()
+    first = runner.submit(lambda job: release.wait(5))
+    second = runner.submit(lambda job: None)
+    assert wait_for(runner, first, ['running'])['status'] == 'running'
+    monkeypatch.setattr(jobs, 'JOB_STALE_TIMEOUT', -1)
+    assert runner.status(second)['status'] == 'queued'
+    monkeypatch.setattr(jobs, 'JOB_STALE_TIMEOUT', 300)
+    release.set()
+    assert wait_for(runner, second, ['done'])['status'] == 'done'
+
+
+def test_job_cancelled_while_queued_never_runs(tmp_path):
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite'), max_workers=1)
+    release = threading.Event()
+    ran = threading.Event()
+    first = runner.submit(lambda job: release.wait(5))
+    second = runner.submit(lambda job: ran.set())
+    runner.cancel(second)
+    release.set()
+    assert wait_for(runner, second, ['cancelled'])['status'] == 'cancelled'
+    runner.executor.shutdown(wait=True)
+    assert not ran.is_set()
+
+
+def test_heartbeat_keeps_running_job_alive(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_HEARTBEAT_INTERVAL', 0.01)
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite'))
+    release = threading.Event()
+    job_id = runner.submit(lambda job: release.wait(5))
+    assert wait_for(runner, job_id, ['running'])['status'] == 'running'
+    monkeypatch.setattr(jobs, 'JOB_STALE_TIMEOUT', 0.5)
+    time.sleep(1)
+    assert runner.status(job_id)['status'] == 'running'
+    release.set()
+    assert wait_for(runner, job_id, ['done'])['status'] == 'done'
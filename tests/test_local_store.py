@@ -0,0 +1,78 @@
+import zipfile
+
+import pytest
+
+from local_store import LocalCrimeStore
+
+COLUMN_HEADING = ['Crime Month', 'Crime Category', 'Location Name', 'Latitude', 'Longitude']
+HEADER = 'Crime ID,Month,Reported by,Falls within,Longitude,Latitude,Location,LSOA code,LSOA name,Crime type,Last outcome category,Context\n'
+
+
+def street_csv(month, crimes):
+    """CSV text in the data.police.uk street file layout, crimes are (id, category, latitude, longitude)."""
+    rows = [f'{i},{month},Test Police,Test Police,{lon},{lat},On or near Test Street,E01,Test 001,{category},,\n'
+            for i, category, lat, lon in crimes]
+    return HEADER + ''.join(rows)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalCrimeStore(str(tmp_path / 'crimes.sqlite'))
+
+
+def test_ingest_zip_archive(store, tmp_path):
+    path = tmp_path / 'archive.zip'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('2020-01/2020-01-test-street.csv', street_csv('2020-01', [('a', 'Burglary', 51.5, -0.1), ('b', 'Drugs', 51.6, -0.2)]))
+        archive.writestr('2020-02/2020-02-test-street.csv', street_csv('2020-02', [('c', 'Robbery', 51.5, -0.1)]))
+        archive.writestr('2020-02/2020-02-test-outcomes.csv', 'ignored')
+    assert store.ingest(str(path)) == 3
+    assert store.months() == ['2020-02', '2020-01']
+
+
+def test_ingest_skips_crimes_without_location(store, tmp_path):
+    path = tmp_path / '2020-01-test-street.csv'
+    path.write_text(street_csv('2020-01', [('a', 'Burglary', 51.5, -0.1), ('b', 'Drugs', '', '')]))
+    assert store.ingest(str(path)) == 1
+
+
+def test_reingest_replaces_partition(store, tmp_path):
+    first = tmp_path / 'first'
+    (first / '2020-01').mkdir(parents=True)
+    (first / '2020-01' / '2020-01-test-street.csv').write_text(
+        street_csv('2020-01', [('a', 'Burglary', 51.5, -0.1), ('b', 'Drugs', 51.5, -0.1)]))
+    (first / '2020-01' / '2020-01-other-street.csv').write_text(
+        street_csv('2020-01', [('c', 'Robbery', 51.5, -0.1)]))
+    store.ingest(str(first))
+    revised = tmp_path / '2020-01-test-street.csv'
+    revised.write_text(street_csv('2020-01', [('d', 'Shoplifting', 51.5, -0.1)]))
+    store.ingest(str(revised))
+
+    square = [(51.4, -0.2), (51.6, -0.2), (51.6, 0.0), (51.4, 0.0)]
+    crimes = store.get_crimes_area(square, '2020-01', COLUMN_HEADING)
+    # the test force partition is replaced, the other force is untouched
+    assert sorted(crimes['Crime Category']) == ['Robbery', 'Shoplifting']
+
+
+def test_get_crimes_area_keeps_points_inside_polygon(store, tmp_path):
+    path = tmp_path / '2020-01-test-street.csv'
+    path.write_text(street_csv('2020-01', [
+        ('a', 'Burglary', 1.0, 1.0),  # inside the lower arm of the L
+        ('b', 'Drugs', 3.0, 1.0),     # inside the upper arm
+        ('c', 'Robbery', 3.0, 3.0),   # inside the bounding box but in the notch
+        ('d', 'Shoplifting', 9.0, 9.0)]))
+    store.ingest(str(path))
+    l_shape = [(0, 0), (4, 0), (4, 2), (2, 2), (2, 4), (0, 4)]
+    crimes = store.get_crimes_area(l_shape, '2020-01', COLUMN_HEADING)
+    assert sorted(crimes['Crime Category']) == ['Burglary', 'Drugs']
+    assert crimes['Crime Month'] == ['2020-01', '2020-01']
+    assert all(isinstance(v, float) for v in crimes['Latitude'])
+
+
+def test_get_crimes_area_none_when_empty(store, tmp_path):
+    path = tmp_path / '2020-01-test-street.csv'
+    path.write_text(street_csv('2020-01', [('a', 'Burglary', 3.0, 3.0)]))
+    store.ingest(str(path))
+    l_shape = [(0, 0), (4, 0), (4, 2), (2, 2), (2, 4), (0, 4)]
+    assert store.get_crimes_area(l_shape, '2020-01', COLUMN_HEADING) is None
+    assert store.get_crimes_area(l_shape, '2020-02', COLUMN_HEADING) is None
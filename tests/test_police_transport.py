@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from police_api import APIError, PoliceAPI
+
+import police_transport
+from police_transport import FileTokenBucket, ThrottledService, TokenBucket
+
+
+class StubServer(object):
+    """Local police api stub answering each request with the next scripted (status, headers, body)."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(self.path)
+                status, headers, body = stub.responses.pop(0) if stub.responses else (200, {}, [])
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(*responses):
+        servers.append(StubServer(responses))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(police_transport, 'BACKOFF_BASE', 0.001)
+
+
+def service(url):
+    return ThrottledService(PoliceAPI(), limiter=TokenBucket(rate=1000, burst=1000), base_url=url)
+
+
+def test_retries_rate_limited_responses(stub):
+    server = stub((429, {'Retry-After':'0'}, None), (502, {}, None), (200, {}, [{'id':'leicestershire'}]))
+    assert service(server.url).request('GET', 'forces') == [{'id':'leicestershire'}]
+    assert len(server.requests) == 3
+
+
+def test_gives_up_after_max_retries(stub):
+    server = stub(*[(500, {}, None)] * (police_transport.MAX_RETRIES + 2))
+    with pytest.raises(APIError):
+        service(server.url).request('GET', 'forces')
+    assert len(server.requests) == police_transport.MAX_RETRIES + 1
+
+
+def test_does_not_retry_too_many_crimes(stub):
+    server = stub((503, {}, None), (200, {}, []))
+    with pytest.raises(APIError):
+        service(server.url).request('GET', 'crimes-street/all-crime')
+    assert len(server.requests) == 1
+
+
+def test_retry_after_is_clamped():
+    class Response(object):
+        headers = {'Retry-After':'3600'}
+    assert service('http://127.0.0.1/')._backoff(0, Response()) == police_transport.BACKOFF_MAX
+
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(rate=50, burst=5)
+    start = time.monotonic()
+    for _ in range(15):
+        bucket.acquire()
+    # the burst is free, the other 10 tokens arrive at 50 a second
+    assert 0.18 <= time.monotonic() - start < 1
+
+
+@pytest.mark.skipif(police_transport.fcntl is None, reason='needs fcntl')
+def test_file_token_bucket_is_shared(tmp_path):
+    path = str(tmp_path / 'rate_limit.json')
+    buckets = [FileTokenBucket(path, rate=50, burst=5), FileTokenBucket(path, rate=50, burst=5)]
+    start = time.monotonic()
+    for i in range(15):
+        buckets[i % 2].acquire()
+    assert 0.18 <= time.monotonic() - start < 1
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+
+from crime_cache import CrimeCache
+from reference_data import Catalogue
+
+
+class StubPolice(object):
+    """Police client answering neighbourhood lists from a dict, counting the calls."""
+
+    def __init__(self, neighbourhoods):
+        self.neighbourhoods = neighbourhoods
+        self.calls = 0
+
+    def get_neighbourhoods(self, force_id):
+        self.calls += 1
+        return [SimpleNamespace(id=i, name=n) for i, n in self.neighbourhoods[force_id]]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CrimeCache(str(tmp_path))
+
+
+def test_neighbourhoods_sorted_by_name(store):
+    police = StubPolice({'f':[('2', 'Westgate'), ('1', 'Abbey'), ('3', 'Marsh')]})
+    catalogue = Catalogue(police, None, store)
+    assert [n['name'] for n in catalogue.neighbourhoods('f')] == ['Abbey', 'Marsh', 'Westgate']
+    assert catalogue.neighbourhood_id('f', 'Marsh') == '3'
+
+
+def test_remembered_neighbourhoods_expire(store, monkeypatch):
+    police = StubPolice({'f':[('1', 'Abbey')]})
+    catalogue = Catalogue(police, None, store, ttl=60)
+    now = 1000
+    monkeypatch.setattr('reference_data.time.time', lambda: now)
+    monkeypatch.setattr('crime_cache.time.time', lambda: now)
+    catalogue.neighbourhoods('f')
+    catalogue.neighbourhoods('f')
+    assert police.calls == 1
+    police.neighbourhoods['f'].append(('2', 'Bridge'))
+    now += 61
+    assert [n['name'] for n in catalogue.neighbourhoods('f')] == ['Abbey', 'Bridge']
+    assert catalogue.neighbourhood_id('f', 'Bridge') == '2'
+    assert police.calls == 2
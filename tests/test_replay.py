@@ -0,0 +1,35 @@
+import json
+
+from benchmarks.replay import record, replay, synthetic_recording
+from police_transport import make_police_api
+
+
+def neighbourhood_crimes(police, meta):
+    """Crime ids for the recorded neighbourhood and months, fetched the way the app does."""
+    force = next(f for f in police.get_forces() if f.name == meta['force'])
+    neighbourhood = next(n for n in police.get_neighbourhoods(force.id) if n.name == meta['neighbourhood'])
+    boundary = police.get_neighbourhood(force.id, neighbourhood.id).boundary
+    return {m:[c.id for c in police.get_crimes_area(boundary, date=m)] for m in meta['months']}
+
+
+def test_record_then_replay(tmp_path):
+    source = synthetic_recording(20, ['2020-01', '2020-02'])
+    path = str(tmp_path / 'recording.json')
+    mock = replay(source)
+    try:
+        police = make_police_api(shared_limit=False)
+        save = record(police, path, source['_meta'])
+        recorded = neighbourhood_crimes(police, source['_meta'])
+        save()
+    finally:
+        mock.stop()
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved['_meta'] == source['_meta']
+    mock = replay(saved)
+    try:
+        assert neighbourhood_crimes(make_police_api(shared_limit=False), saved['_meta']) == recorded
+    finally:
+        mock.stop()
+    assert all(len(ids) == 20 for ids in recorded.values())
+
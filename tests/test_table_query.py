@@ -0,0 +1,41 @@
+import pandas as pd
+
+from table_query import filter_frame, split_filter_part, table_page
+
+
+def crime_frame():
+    return pd.DataFrame({
+        'Crime Month':pd.Categorical(['2019-12', '2020-01', '2020-01']),
+        'Crime Category':pd.Categorical(['Burglary', 'Drugs', 'Robbery']),
+        'Location Name':['On or near 1e20 Street', 'On or near High Street', 'On or near 2019'],
+        'Latitude':[51.5, 51.6, 51.7],
+        'Longitude':[-0.1, -0.2, -0.3]})
+
+
+def test_split_filter_part_keeps_the_typed_value():
+    assert split_filter_part('{Latitude} ge 51.6') == ('Latitude', 'ge', '51.6')
+    assert split_filter_part('{Location Name} eq "On or near 2019"') == ('Location Name', 'eq', 'On or near 2019')
+    assert split_filter_part('no column') == (None, None, None)
+
+
+def test_numeric_comparison():
+    assert filter_frame(crime_frame(), '{Latitude} > 51.55')['Crime Category'].tolist() == ['Drugs', 'Robbery']
+
+
+def test_text_in_numeric_column_is_ignored():
+    df = crime_frame()
+    assert len(filter_frame(df, '{Latitude} > abc')) == 3
+    assert filter_frame(df, '{Latitude} > abc && {Crime Category} eq Drugs')['Crime Category'].tolist() == ['Drugs']
+
+
+def test_number_typed_into_text_column_is_compared_as_typed():
+    df = crime_frame()
+    assert filter_frame(df, '{Location Name} eq 2019').empty
+    assert filter_frame(df, '{Crime Month} eq 2020-01')['Crime Category'].tolist() == ['Drugs', 'Robbery']
+    assert filter_frame(df, '{Location Name} contains 1e20')['Crime Category'].tolist() == ['Burglary']
+
+
+def test_table_page():
+    records, page_count = table_page(crime_frame(), 1, 2, [{'column_id':'Latitude', 'direction':'desc'}])
+    assert page_count == 2
+    assert [r['Crime Category'] for r in records] == ['Burglary']
@@ -0,0 +1,90 @@
+# Cache warming command.
+# Walks every police force and neighbourhood and fills the boundary, centre,
+# crime and rollup caches and the overview map shapes read by the app, so
+# first visitors do not wait on the police api. Work runs in a process pool
+# whose workers share the api rate limit through the police_transport rate
+# limit file. Results land in CRIME_CACHE_DIR, which must be the directory the
+# web processes read, see the readme.
+#
+# Usage: python warm_cache.py [--months 1] [--workers 4] [--force metropolitan] [--restart]
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app
+from crime_cache import CACHE_DIR
+
+
+def warm_neighbourhood(police_id, neighbourhood_id, months):
+    """Fill every cache for one neighbourhood and the given months."""
+    boundary = app.catalogue.boundary(police_id, neighbourhood_id)
+    app.catalogue.centre(police_id, neighbourhood_id)
+    app.store_overview_shape(police_id, neighbourhood_id, boundary)
+    for month in months:
+        app.get_neighbourhood_crimes(police_id, neighbourhood_id, month)
+    app.update_rollups(police_id, neighbourhood_id, months)
+
+
+def progress_path(months):
+    return os.path.join(CACHE_DIR, f'warm_progress_{months[0]}_{months[-1]}.txt')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-populate the crime caches for every force and neighbourhood.')
+    parser.add_argument('--months', type=int, default=1, help='number of latest months to warm (default 1)')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes (default 4)')
+    parser.add_argument('--force', action='append', help='only warm this force id, may be repeated')
+    parser.add_argument('--restart', action='store_true', help='ignore progress saved by an earlier run')
+    args = parser.parse_args()
+    if os.environ.get('DYNO', '').startswith('run.'):
+        print(f'Warning: one-off Heroku dynos have their own filesystem, {CACHE_DIR} is not seen by the web dyno.')
+
+    try:
+        app.reference.refresh()
+    except Exception as e:
+        print(f'Could not refresh reference data, using the saved snapshot: {e}')
+    months = sorted(app.reference.dates[:args.months])
+    if months == []:
+        sys.exit('No reference data available.')
+    force_ids = [f['id'] for f in app.reference.forces if args.force is None or f['id'] in args.force]
+    app.catalogue.prefetch()
+    tasks = [(f, n['id']) for f in force_ids for n in app.catalogue.neighbourhoods(f)]
+
+    # Finished neighbourhoods are appended to the progress file so an interrupted run can resume
+    path = progress_path(months)
+    if args.restart and os.path.exists(path):
+        os.remove(path)
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            done = {tuple(line.rstrip('\n').split('\t')) for line in f if line.strip()}
+    pending = [t for t in tasks if t not in done]
+    print(f'Warming {app.period_label(months)}: {len(tasks)} neighbourhoods, {len(tasks) - len(pending)} already done.')
+
+    start = time.time()
+    failed = 0
+    # spawn so workers open their own sqlite connections instead of inheriting ours
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as executor, open(path, 'a') as progress:
+        futures = {executor.submit(warm_neighbourhood, p, n, months):(p, n) for p, n in pending}
+        for count, future in enumerate(as_completed(futures), 1):
+            police_id, neighbourhood_id = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f'[{count}/{len(pending)}] {police_id}/{neighbourhood_id} failed: {e}')
+                continue
+            progress.write(f'{police_id}\t{neighbourhood_id}\n')
+            progress.flush()
+            elapsed = time.time() - start
+            remaining = elapsed / count * (len(pending) - count)
+            print(f'[{count}/{len(pending)}] {police_id}/{neighbourhood_id} ({elapsed:.0f}s elapsed, about {remaining:.0f}s left)')
+    print(f'Finished, {failed} neighbourhoods failed. Run again to retry them.')
+
+
+if __name__ == '__main__':
+    main()